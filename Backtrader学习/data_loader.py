@@ -0,0 +1,241 @@
+'''
+公用的数据加载函数.
+每天的脚本都要读取 *_year_data.csv, 第一次读取后保存成parquet, 之后直接读parquet, 更快.
+'''
+
+import functools
+import math
+import os
+import numpy as np
+import pandas as pd
+import backtrader as bt
+
+# 有安装TA-Lib的话RSI直接用它的C实现, 没有就用下面pandas的写法
+try:
+    import talib
+    HAS_TALIB = True
+except ImportError:
+    HAS_TALIB = False
+
+# 没有TA-Lib但有numba的话, RSI的平滑循环用numba编译
+# 每天的脚本也从这里导入 njit 和 HAS_NUMBA, 不用各自再写一遍
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):      # 没有numba时, 装饰器什么都不做
+        def decorator(func):
+            return func
+        return decorator
+
+
+# *_year_data.csv 的列和类型都是固定的, 直接告诉read_csv, 不用再猜类型
+# volume 在csv里写成 52899042.0, 所以也用float64
+CSV_COLUMNS = ['date', 'open', 'high', 'low', 'close', 'volume']
+CSV_DTYPES = {'open': 'float64', 'high': 'float64', 'low': 'float64', 'close': 'float64', 'volume': 'float64'}
+
+
+def read_price_csv(csv_path):
+    # 只读需要的列, 用C引擎, 日期读的时候就转好并设成索引
+    return pd.read_csv(csv_path, usecols=CSV_COLUMNS, dtype=CSV_DTYPES, parse_dates=['date'],
+                       date_format='%Y-%m-%d', index_col='date', engine='c')
+
+
+def load_df(csv_path):
+    # 同一个进程里同一个文件只读一次; 返回副本, 因为很多脚本会在上面加指标列
+    return _load_df_cached(csv_path).copy()
+
+
+@functools.lru_cache(maxsize=32)
+def _load_df_cached(csv_path):
+    parquet_path = csv_path + '.parquet'
+
+    # parquet 存在并且比csv新, 就直接读取parquet (以前保存的parquet里还有openinterest列, 只读需要的列)
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path):
+        return pd.read_parquet(parquet_path, columns=CSV_COLUMNS[1:])
+
+    # 不再加全是0的openinterest列: DirectData 找不到这一列就不读, Backtrader里这条线是nan, 没有脚本用到
+    df = read_price_csv(csv_path)
+
+    # 价格保持float64: Backtrader 的每条线都存在 array('d') 里, 传float32进去也会被转回double,
+    # 省不了内存, 反而价格会有误差 (33.03 -> 33.029998779296875), 止盈止损的比较也可能变
+
+    # 保存成parquet, 没有安装pyarrow的话就不保存
+    try:
+        df.to_parquet(parquet_path, engine='pyarrow', compression='snappy')
+    except ImportError:
+        pass
+    return df
+
+
+def bt_sma(series, period):
+    # 和 bt.indicators.SMA 一样用 math.fsum 求和: rolling().mean() 是滚动累加, 两条均线本来相等时会差 1e-15, 交叉信号就变了
+    values = series.to_numpy(dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) >= period:
+        windows = np.lib.stride_tricks.sliding_window_view(values, period)
+        out[period - 1:] = [math.fsum(w) for w in windows]
+        out[period - 1:] /= period
+    return pd.Series(out, index=series.index)
+
+
+def bt_ema(series, period, alpha=None):
+    # 和 bt.indicators.EMA 一样: 前 period 个值先算简单平均当起点, 之前都是nan
+    # alpha 默认 2/(period+1); RSI 用的平滑(SMMA)是 alpha=1/period
+    values = series.dropna()
+    out = pd.Series(np.nan, index=series.index)
+    if len(values) < period:
+        return out
+    seeded = values.iloc[period - 1:].copy()
+    seeded.iloc[0] = values.iloc[:period].mean()
+    if alpha is None:
+        out[seeded.index] = seeded.ewm(span=period, adjust=False).mean()
+    else:
+        out[seeded.index] = seeded.ewm(alpha=alpha, adjust=False).mean()
+    return out
+
+
+def _rsi_wilder(close, period):
+    # 一次循环算完整条RSI: 第1到period天涨跌幅的平均当起点, 之后每天 avg += (今天 - avg) / period
+    n = close.shape[0]
+    out = np.full(n, np.nan)
+    if n <= period:
+        return out
+    avg_up = 0.0
+    avg_down = 0.0
+    for i in range(1, period + 1):
+        change = close[i] - close[i - 1]
+        if change > 0:
+            avg_up += change
+        else:
+            avg_down -= change
+    avg_up /= period
+    avg_down /= period
+    out[period] = 100.0 - 100.0 / (1.0 + avg_up / avg_down)
+    for i in range(period + 1, n):
+        change = close[i] - close[i - 1]
+        avg_up += (max(change, 0.0) - avg_up) / period
+        avg_down += (max(-change, 0.0) - avg_down) / period
+        out[i] = 100.0 - 100.0 / (1.0 + avg_up / avg_down)
+    return out
+
+
+if HAS_NUMBA:
+    # error_model='numpy': 只涨不跌时 avg_down=0, 除出来是inf, RSI=100, 和pandas一样不报错
+    _rsi_wilder = njit(cache=True, error_model='numpy')(_rsi_wilder)
+
+
+def bt_rsi(close, period=14):
+    # 和 bt.indicators.RSI 一样: 涨跌幅分别用SMMA平滑, 再算 100 - 100 / (1 + RS)
+    # talib.RSI 也是用前 period 天的平均当起点, 结果一样; 中间有nan时还是用pandas算
+    if HAS_TALIB and not close.isna().any():
+        return pd.Series(talib.RSI(close.to_numpy(dtype=np.float64), timeperiod=period), index=close.index)
+    if HAS_NUMBA and not close.isna().any():
+        return pd.Series(_rsi_wilder(close.to_numpy(dtype=np.float64), period), index=close.index)
+    diff = close.diff()
+    up = diff.clip(lower=0)
+    down = (-diff).clip(lower=0)
+    rs = bt_ema(up, period, alpha=1.0 / period) / bt_ema(down, period, alpha=1.0 / period)
+    return 100.0 - 100.0 / (1.0 + rs)
+
+
+def bt_crossover(a, b=0):
+    # 和 bt.indicators.CrossOver 一样: 上穿=1, 下穿=-1, 其它=0
+    # 前一天用的是"上一个不为0的差值", 所以刚好等于0的那天不会被算成交叉
+    diff = a - b
+    nzd = diff.where(diff != 0).ffill()
+    upcross = (nzd.shift() < 0) & (a > b)
+    downcross = (nzd.shift() > 0) & (a < b)
+    return upcross.astype(np.float64) - downcross.astype(np.float64)
+
+
+def run_vectorized(df, short, long, cash=10000, commission=0.001, stake=100):
+    ''' 双均线策略 (短均线>长均线买入, 短均线<长均线卖出) 不用Backtrader, 直接用numpy算出期末资金.
+    规则和Backtrader一样: 信号出现后下一根K线开盘成交, 每次买卖stake股, 手续费按成交额收;
+    钱不够(按信号当天收盘价或成交时开盘价算)的买单会被拒绝, 下一根K线再试. '''
+    close = df['close'].to_numpy()
+    open_price = df['open'].to_numpy()
+    n = len(close)
+    short_ma = bt_sma(df['close'], short).to_numpy()
+    long_ma = bt_sma(df['close'], long).to_numpy()
+
+    # 最后一根K线下的单不会成交, 所以只看到倒数第二根
+    above = short_ma[:-1] > long_ma[:-1]
+    below = short_ma[:-1] < long_ma[:-1]
+    above[:long - 1] = False        # 长均线算好之前不交易
+    below[:long - 1] = False
+
+    # 空仓时现金不变, 所以每段空仓期里第一个"信号成立并且钱够"的K线就是买入点; 只循环交易次数, 不循环每根K线
+    t = 0
+    in_position = False
+    while True:
+        if not in_position:
+            ok = above[t:] & (cash >= stake * close[t:-1] * (1 + commission)) & (cash >= stake * open_price[t + 1:] * (1 + commission))
+        else:
+            ok = below[t:]
+        hits = np.flatnonzero(ok)
+        if len(hits) == 0:
+            break
+        t = t + hits[0] + 1         # 下一根K线开盘成交
+        if not in_position:
+            cash -= stake * open_price[t] * (1 + commission)
+        else:
+            cash += stake * open_price[t] * (1 - commission)
+        in_position = not in_position
+        if t >= n - 1:
+            break
+
+    return cash + in_position * stake * close[-1]
+
+
+def add_macd(df, fast=12, slow=26, signal=9):
+    # 一次性用pandas算好整条MACD, 不用Backtrader每根K线再算
+    df['ema_fast'] = bt_ema(df['close'], fast)
+    df['ema_slow'] = bt_ema(df['close'], slow)
+    df['macd'] = df['ema_fast'] - df['ema_slow']
+    df['signal'] = bt_ema(df['macd'], signal)
+    df['hist'] = df['macd'] - df['signal']        # 柱状图 DIF - DEA
+    return df
+
+
+class DirectData(bt.feeds.PandasDirectData):
+    def start(self):
+        super().start()
+        # 先把所有日期转成 datetime64[D] 数组, 每根K线直接按位置取, 不用再把浮点数转回日期
+        self._dates = self.p.dataname.index.values.astype('datetime64[D]')
+
+        # 每条线按列名(不分大小写)找到它在itertuples里的位置, 第0个是索引所以要+1
+        # 这样没有openinterest列, 或者列名是 Open/Close 的数据也能直接用; 找不到的标准列设成-1(跳过)
+        columns = [str(c).lower() for c in self.p.dataname.columns]
+        for line in self.getlinealiases():
+            if line == 'datetime':
+                continue
+            if line in columns:
+                setattr(self.params, line, columns.index(line) + 1)
+            elif line in self.datafields:
+                setattr(self.params, line, -1)
+
+    def current_date(self):
+        # 当前K线的日期, 代替 self.datetime.date(0)
+        return self._dates[len(self) - 1]
+
+    def _load(self):
+        loaded = super()._load()
+        if not loaded:
+            # 数据读完以后丢掉itertuples迭代器, 不然多进程参数优化时没办法pickle
+            self._rows = None
+        return loaded
+
+
+# 带有预先算好的MACD的数据, 需要先用add_macd加好列
+class MACDData(DirectData):
+    lines = ('macd', 'signal', 'hist')
+    params = (('macd', -1), ('signal', -1), ('hist', -1))
+
+
+def load_data(csv_path, name=''):
+    df = load_df(csv_path)
+    # PandasDirectData 直接用itertuples按位置读取, 不用每根K线按列名查找
+    return DirectData(dataname=df, name=name)
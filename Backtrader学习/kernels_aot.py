@@ -0,0 +1,56 @@
+'''
+用 numba.pycc 提前编译 WMA 和 MACD 的计算核心, 生成 kernels 扩展模块 (.so / .pyd).
+编译一次:
+    python kernels_aot.py
+之后 第16天 等脚本直接 import kernels, 运行时不用再等numba即时编译.
+没有编译过的话, 脚本会自动退回到 njit 或 numpy 的写法.
+'''
+
+import numpy as np
+from numba import njit
+from numba.pycc import CC
+
+cc = CC('kernels')
+
+
+# 加权移动平均: 最旧的价格权重是1, 最新的是period, 前 period-1 天是nan
+@cc.export('wma_f64', 'f8[:](f8[:], i8)')
+def wma_f64(closes, period):
+    n = closes.shape[0]
+    out = np.full(n, np.nan)
+    denom = period * (period + 1) / 2
+    for i in range(period - 1, n):
+        acc = 0.0
+        for k in range(period):
+            acc += closes[i - period + 1 + k] * (k + 1)
+        out[i] = acc / denom
+    return out
+
+
+# 和 bt.indicators.EMA 一样: 从 start 开始, 前 period 个值的简单平均当起点
+@njit     # 被导出函数调用的辅助函数也要编译
+def _ema(values, period, start):
+    n = values.shape[0]
+    out = np.full(n, np.nan)
+    first = start + period - 1
+    if first >= n:
+        return out
+    acc = 0.0
+    for i in range(start, first + 1):
+        acc += values[i]
+    out[first] = acc / period
+    alpha = 2.0 / (period + 1)
+    for i in range(first + 1, n):
+        out[i] = out[i - 1] + alpha * (values[i] - out[i - 1])
+    return out
+
+
+# MACD柱状图 (DIF - DEA), 和 data_loader.add_macd 算出来的 hist 一样
+@cc.export('macd_hist_f64', 'f8[:](f8[:], i8, i8, i8)')
+def macd_hist_f64(closes, fast, slow, signal):
+    macd = _ema(closes, fast, 0) - _ema(closes, slow, 0)
+    return macd - _ema(macd, signal, slow - 1)      # macd 从第 slow 天才有值
+
+
+if __name__ == '__main__':
+    cc.compile()
@@ -2,46 +2,104 @@
 由于获取数据有limit, 我们就保存数据, 之后才读取数据来回测.
 '''
 
+import argparse
+import asyncio
 import pandas as pd
-from alpha_vantage.timeseries import TimeSeries
+import requests
+from alpha_vantage.async_support.timeseries import TimeSeries     # 异步版本, 可以同时发多个请求
 from datetime import datetime
-import time  # 加个延迟的
 
-def save_stock_data(symbols, api_key):
-    ts = TimeSeries(key=api_key, output_format='pandas')
+async def fetch_stock_data(ts, symbol, tokens):
+    await tokens.acquire()      # 拿一个令牌, 用掉就不还, 由refill_tokens每12秒补回来
+    try:
+        data, _ = await ts.get_daily(symbol=symbol, outputsize='full')
+        data = data.rename(columns={
+            '1. open': 'open',
+            '2. high': 'high',
+            '3. low': 'low',
+            '4. close': 'close',
+            '5. volume': 'volume'
+        })
+
+        data.index = pd.to_datetime(data.index, format='%Y-%m-%d')      # 日期都是 2025-05-30 这种格式, 不用再猜
+        data = data.sort_index()
+
+        # 只要一年的数据
+        one_year_ago = datetime.now() - pd.DateOffset(years=1)
+        data = data[data.index >= one_year_ago]
 
-    for symbol in symbols:
+        # 保存数据到CSV
+        filename = f"./{symbol}_year_data.csv"
+        data.to_csv(filename)
+        print(f"已经保存{symbol}数据到{filename}")
+    except Exception as e:
+        print(f" 获取{symbol}失败: {e}")
+
+async def refill_tokens(tokens):
+    # 令牌桶: 免费版每分钟最多5次请求, 所以每12秒补一个令牌, 最多存5个
+    while True:
+        await asyncio.sleep(12)
         try:
-            data, _ = ts.get_daily(symbol=symbol, outputsize='full')
-            data = data.rename(columns={
-                '1. open': 'open',
-                '2. high': 'high',
-                '3. low': 'low',
-                '4. close': 'close',
-                '5. volume': 'volume'
-            })
-
-            data.index = pd.to_datetime(data.index)
-            data = data.sort_index()
-
-            # 只要一年的数据
-            one_year_ago = datetime.now() - pd.DateOffset(years=1)
-            data = data[data.index >= one_year_ago]
-
-            # 保存数据到CSV
-            filename = f"./{symbol}_year_data.csv"
-            data.to_csv(filename)
-            print(f"已经保存{symbol}数据到{filename}")
-        except Exception as e:
-            print(f" 获取{symbol}失败: {e}")
-
-        time.sleep(12)
+            tokens.release()
+        except ValueError:      # 桶已经满了
+            pass
+
+async def save_stock_data_async(symbols, api_key):
+    ts = TimeSeries(key=api_key, output_format='pandas')
+    tokens = asyncio.BoundedSemaphore(5)      # 一开始桶是满的, 前5个请求马上发出去
+    refill = asyncio.create_task(refill_tokens(tokens))
+    try:
+        await asyncio.gather(*(fetch_stock_data(ts, symbol, tokens) for symbol in symbols))
+    finally:
+        refill.cancel()
+        await ts.close()    # 关闭连接
+
+def save_stock_quotes(symbols, api_key):
+    ''' 只要最新报价的话, 一次请求就可以拿100个股票, 不用一个一个请求.
+    注意: 报价只有 symbol, price, volume, timestamp 四列, 没有open/high/low/close, 不能拿来回测. '''
+    quotes = []
+    for i in range(0, len(symbols), 100):      # 每100个股票一组
+        chunk = symbols[i:i + 100]
+        resp = requests.get(
+            'https://www.alphavantage.co/query',
+            params={'function': 'BATCH_STOCK_QUOTES', 'symbols': ','.join(chunk), 'apikey': api_key},
+            timeout=30
+        )
+        resp.raise_for_status()
+        result = resp.json()
+        # 超过次数限制或者参数错误时, 返回的是 "Note" / "Error Message", 没有 'Stock Quotes'; 不能当成0个报价保存
+        if 'Stock Quotes' not in result:
+            raise RuntimeError(f"获取报价失败: {result.get('Note') or result.get('Error Message') or result}")
+        quotes.extend(result['Stock Quotes'])
+
+    data = pd.DataFrame(quotes).rename(columns={
+        '1. symbol': 'symbol',
+        '2. price': 'price',
+        '3. volume': 'volume',
+        '4. timestamp': 'timestamp'
+    })
+
+    # 保存数据到CSV
+    filename = f"./quotes_{datetime.now():%Y%m%d}.csv"
+    data.to_csv(filename, index=False)
+    print(f"已经保存{len(data)}个股票报价到{filename}")
+
+def save_stock_data(symbols, api_key, mode='daily'):
+    # mode='quote' 只要最新报价; 默认 'daily' 获取一年的日线数据
+    if mode == 'quote':
+        save_stock_quotes(symbols, api_key)
+    else:
+        asyncio.run(save_stock_data_async(symbols, api_key))
 
 if __name__ == "__main__":
-    stock_input = input(f"请输入股票: ")
-    stock_list = [s.strip().upper() for s in stock_input.split(',') if s.strip()]
+    # 股票代码从命令行传进来, 不用input, 可以不用人守着批量跑
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tickers', default='AAPL', help='股票代码, 多个用逗号分开, 比如 AAPL,BABA')
+    parser.add_argument('--mode', choices=['daily', 'quote'], default='daily', help='daily: 一年的日线数据; quote: 只要最新报价')
+    args = parser.parse_args()
+    stock_list = [s.strip().upper() for s in args.tickers.split(',') if s.strip()]
     api_key = 'LNCEEYGQUGYZCRGO'
-    save_stock_data(stock_list, api_key)
+    save_stock_data(stock_list, api_key, mode=args.mode)
 
 
 """   没办法获取更多数据. 每个月最多25次. """
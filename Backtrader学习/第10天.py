@@ -3,19 +3,10 @@
 	整合成交量指标，设计成交量均线策略。
 '''
 
-import pandas as pd
+import argparse
 import backtrader as bt
+from data_loader import load_data
 
-# 获取数据
-def load_data():
-    file_path = './GME_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
-    # print(df)
-    data = bt.feeds.PandasData(dataname=df)
-    return data
 
 class Volume_SMA_Strategy(bt.Strategy):
     params = (
@@ -35,33 +26,33 @@ class Volume_SMA_Strategy(bt.Strategy):
         if self.order:
             return
 
+        current_price = self.data.close[0]      # 只取一次当前价格
         if not self.position:
             # 买入条件: 当前成交量 > 成交量均线 和 当前价格 > 价格均线
-            if self.data.volume[0] > self.volume_ma[0] and self.data.close[0] > self.price_ma[0]:
-                self.buy_price = self.data.close[0]
+            if self.data.volume[0] > self.volume_ma[0] and current_price > self.price_ma[0]:
+                self.buy_price = current_price
                 self.order = self.buy()
-                print(f"买入时间: {self.datas[0].datetime.date(0)}, 买入股价: {self.buy_price}")
+                print(f"买入时间: {self.datas[0].current_date()}, 买入股价: {self.buy_price}")
 
         else:
-            current_price = self.data.close[0]
             # 计算止损和止盈
             take_profit = self.buy_price * (1 + self.params.take_profit)
             stop_loss = self.buy_price * ( 1- self.params.stop_loss)
 
             if current_price >=take_profit:
                 self.order = self.close()
-                print(f"止盈卖出时间:{self.datas[0].datetime.date(0)}, 当前价格:{current_price:.2f}, 买入股价: {self.buy_price}")
+                print(f"止盈卖出时间:{self.datas[0].current_date()}, 当前价格:{current_price:.2f}, 买入股价: {self.buy_price}")
             elif current_price <= stop_loss:
                 self.order = self.close()
-                print(f"止损卖出时间: {self.datas[0].datetime.date(0)}, 当前价格:{current_price:.2f}, 买入股价: {self.buy_price}")
+                print(f"止损卖出时间: {self.datas[0].current_date()}, 当前价格:{current_price:.2f}, 买入股价: {self.buy_price}")
 
     def notify_order(self, order):
         if order.status in [order.Completed, order.Canceled, order.Rejected]:
             self.order = None
 
-def run_testing():
+def run_testing(plot=False):
     cerebro = bt.Cerebro()
-    data = load_data()
+    data = load_data('./GME_year_data.csv')
     cerebro.adddata(data)
     cerebro.addstrategy(Volume_SMA_Strategy)
 
@@ -72,7 +63,11 @@ def run_testing():
     print(f"初始资金: {cerebro.broker.getvalue():.2f}")
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue():.2f}")
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 if __name__ == "__main__":
-    run_testing()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testing(plot=args.plot)
\ No newline at end of file
@@ -3,19 +3,10 @@
 	练习：*在Backtrader中加入成交量和成交量均线，设定基于成交量变化的买卖规则，并运行回测。
 '''
 
+import argparse
 import backtrader as bt
-import pandas as pd
+from data_loader import load_data
 
-def load_data():
-    file_path = './AAL_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
-    # print(df.head())
-
-    data = bt.feeds.PandasData(dataname=df)
-    return data
 
 class volume_strategy(bt.Strategy):
     ''' 加入其它指标(MA)'''
@@ -27,11 +18,11 @@ class volume_strategy(bt.Strategy):
 
     def next(self):
         ''' 优化代码. 看起来比较好读.'''
-        current_date = self.datas[0].datetime.date(0)
+        current_date = self.datas[0].current_date()
         current_volume = self.data.volume[0]
         volume_avg = self.vol_ma[0]
         current_close_price = self.data.close[0]
-        close_avg = self.price_ma
+        close_avg = self.price_ma[0]        # 要用[0]取当前的值, 不然拿到的是整条线
 
         if not self.position:
             # 成交量 > 均量 并且 收盘价 > 收盘均价: 买入
@@ -53,11 +44,11 @@ class volume_strategy(bt.Strategy):
                       f"均量: {volume_avg}, "
                       f"价格: {current_close_price}")
 
-def run_testing():
+def run_testing(plot=False):
     cerebro = bt.Cerebro()
     cerebro.addstrategy(volume_strategy)
 
-    data = load_data()
+    data = load_data('./AAL_year_data.csv')
     cerebro.adddata(data)
 
     cerebro.broker.setcash(10000)
@@ -67,7 +58,11 @@ def run_testing():
     print(f"初始资金: {cerebro.broker.getvalue():.2f}")
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue():.2f}")
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 if __name__ == "__main__":
-    run_testing()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testing(plot=args.plot)
\ No newline at end of file
@@ -3,22 +3,9 @@
 	引入MACD指标，基于MACD柱状图制定交易信号。
 '''
 
+import argparse
 import backtrader as bt
-import pandas as pd
-
-
-
-# 读取数据
-def load_data():
-    file_path = './COIN_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
-    # print(df.head())
-
-    data = bt.feeds.PandasData(dataname=df)
-    return data
+from data_loader import load_df, add_macd, MACDData
 
 
 class MACD_Strategy(bt.Strategy):
@@ -29,24 +16,22 @@ class MACD_Strategy(bt.Strategy):
     '''止损还是20%比较好. '''
 
     def __init__(self):
-        # 添加 MACD 指标
-        macd = bt.indicators.MACD(self.data)
-
-        # Backtrader 没有提供histo.  需要自己对手写
-        self.macd_hist = macd.macd - macd.signal        # 柱状图 DIF - DEA
+        # MACD 柱状图已经在add_macd里用pandas算好了, 直接读数据上的hist线
+        # Backtrader 没有提供histo.  需要自己对手写: 柱状图 DIF - DEA
+        self.macd_hist = self.data.hist
         self.buy_price = None
 
 
     # 加入追踪记录Log
     def log(self, txt):
-        dt = self.datas[0].datetime.date(0) # 当前数据的时间
-        print(f"{dt.isoformat()} {txt}")
+        dt = self.datas[0].current_date() # 当前数据的时间
+        print(f"{dt} {txt}")
 
     def next(self):
         price = self.data.close[0]
         if not self.position:
             if self.macd_hist[0] > 0 and self.macd_hist[-1] <= 0:
-                self.log(f"买入 @ {self.data.close[0]:.2f}")
+                self.log(f"买入 @ {price:.2f}")
                 self.buy()
                 self.buy_price = price
         else:
@@ -70,10 +55,10 @@ class MACD_Strategy(bt.Strategy):
                 self.buy_price = None
 
 
-def run_testing():
+def run_testing(plot=False):
     cerebro = bt.Cerebro()
     cerebro.addstrategy(MACD_Strategy)
-    data = load_data()
+    data = MACDData(dataname=add_macd(load_df('./COIN_year_data.csv')))
     cerebro.adddata(data)
     cerebro.broker.setcash(100000)
     cerebro.broker.setcommission(commission=0.01)
@@ -81,11 +66,15 @@ def run_testing():
     print(f"初始资金: {cerebro.broker.getvalue():.2f}")
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue():.2f}")
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 
 if __name__ == "__main__":
-    run_testing()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testing(plot=args.plot)
 
 
     '''试一试其它的股票'''
\ No newline at end of file
@@ -3,18 +3,20 @@
 	**练习：**在策略中实现MACD并设定柱状图判断逻辑，回测并输出策略表现图表。
 '''
 
+import argparse
 import backtrader as bt
-import pandas as pd
+from data_loader import load_df, add_macd, bt_crossover, MACDData
 
-def load_data():
-    file_path = './COIN_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
 
-    data = bt.feeds.PandasData(dataname=df)
-    return data
+# 在MACD数据上再加一条交叉信号线: 上穿=1, 下穿=-1
+class CrossData(MACDData):
+    lines = ('cross',)
+    params = (('cross', -1),)
+
+def add_cross(df):
+    df['cross'] = bt_crossover(df['hist'], 0)      # 柱状图上穿/下穿0轴
+    return df
+
 
 class MACD_Strategy(bt.Strategy):
     params = (
@@ -23,21 +25,20 @@ class MACD_Strategy(bt.Strategy):
     )
 
     def __init__(self):
-        macd = bt.indicators.MACD(self.data)
-        self.macd_hist = macd.macd - macd.signal
-        self.crossover = bt.indicators.CrossOver(self.macd_hist, 0)
+        self.macd_hist = self.data.hist     # 预先算好的MACD柱状图
+        self.crossover = self.data.cross    # 预先算好的交叉信号, 不用每根K线再算CrossOver
         self.buy_price = None
         self.buy_date = None
 
     def log(self, txt):
-        dt = self.datas[0].datetime.date(0)
-        print(f"{dt.isoformat()} {txt}")
+        dt = self.datas[0].current_date()
+        print(f"{dt} {txt}")
 
     def next(self):
-        current_date = self.datas[0].datetime.date(0)
+        current_date = self.datas[0].current_date()
         current_price = self.data.close[0]
         if not self.position:
-            if self.crossover > 0:
+            if self.crossover[0] > 0:
                 self.buy()
                 self.buy_price = current_price
                 self.buy_date = current_date
@@ -57,7 +58,7 @@ class MACD_Strategy(bt.Strategy):
                 reason = '止损触发'
 
             # MACD 平仓
-            elif self.crossover < 0:
+            elif self.crossover[0] < 0:
                 reason = 'MACD 死叉'
 
             if reason:
@@ -70,10 +71,10 @@ class MACD_Strategy(bt.Strategy):
                 self.buy_date = None
 
 
-def run_testing():
+def run_testing(plot=False):
     cerebro = bt.Cerebro()
     cerebro.addstrategy(MACD_Strategy)
-    data = load_data()
+    data = CrossData(dataname=add_cross(add_macd(load_df('./COIN_year_data.csv'))))
     cerebro.adddata(data)
     cerebro.broker.setcash(100000)
     cerebro.broker.setcommission(commission=0.01)
@@ -82,10 +83,14 @@ def run_testing():
     print(f" 初始资金: {cerebro.broker.getvalue():.2f}")
     cerebro.run()
     print(f" 最终资金: {cerebro.broker.getvalue():.2f}")
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 if __name__ == "__main__":
-    run_testing()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testing(plot=args.plot)
 
 
 '''' 算了就这样吧.   有显示时间就显示吧. 打印出来的前面有时间是卖出时间. '''
\ No newline at end of file
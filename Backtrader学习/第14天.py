@@ -4,22 +4,13 @@
     学习策略参数优化：使用 Backtrader 自动搜索最优参数
 '''
 
-import backtrader as bt
+import functools
+import itertools
+import numpy as np
 import pandas as pd
+import backtrader as bt
+from data_loader import load_df, bt_ema, bt_crossover, DirectData
 
-# 加载数据
-def load_data():
-    file_path = './DIS_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
-
-    data = bt.feeds.PandasData(dataname=df)
-    return data
-
-# results 是全局变量
-results = []    # 把优化参数数据存储到这里来
 
 class MACD_strategy(bt.Strategy):
     params = (
@@ -51,50 +42,115 @@ class MACD_strategy(bt.Strategy):
             if self.cross < 0 or change >= self.params.take_profit or change <= -self.params.stop_loss:
                 self.close()
 
-    def stop(self):
-        # 现在 这里是局部变量.  我需要把下面的代码加入到全局变量里.
-        global results
-        final_value = self.broker.getvalue()
-        # print(f"fast={self.params.fast}, "
-        #       f"slow={self.params.slow}, "
-        #       f"signal={self.params.signal}, "
-        #       f"tp={self.params.take_profit}, "
-        #       f"sl={self.params.stop_loss}, "
-        #       f"Final Value={self.broker.getvalue():.2f}")
-
-        result = {
-            'fast': self.params.fast,
-            'slow': self.params.slow,
-            'signal': self.params.signal,
-            'take_profit': self.params.take_profit,
-            'stop_loss': self.params.stop_loss,
-            'Final Value': final_value
-                  }
-        results.append(result)
-
-def run_testing():
-    cerebro = bt.Cerebro()
 
-    data = load_data()   # 需要调用load_data
-    cerebro.adddata(data)
+# 参数网格: 5 x 6 x 7 x 3 x 3 = 1890 组
+PARAM_GRID = {
+    'fast': range(10, 15, 1),     # fast EMA 参数
+    'slow': range(24, 30, 1),     # slow EMA 参数
+    'signal': range(8, 15, 1),    # signal EMA 参数
+    'take_profit': [0.05, 0.1, 0.5],
+    'stop_loss': [0.02, 0.1, 0.2]
+}
+CASH = 10000
+COMMISSION = 0.01
+STAKE = 100
 
-    # 优化参数
-    cerebro.optstrategy(
-        MACD_strategy,
-        fast=range(10, 15, 1),     # fast EMA 参数
-        slow=range(24, 30, 1),     # slow EMA 参数
-        signal=range(8, 15, 1),    # signal EMA 参数
-        take_profit=[0.05, 0.1, 0.5],
-        stop_loss=[0.02, 0.1, 0.2]
-    )
 
+# 同一个csv的数据和EMA只算一次, 同一个进程里再跑网格(比如换止盈止损)也直接用缓存
+@functools.lru_cache(maxsize=8)
+def _load(csv_path):
+    return load_df(csv_path)
+
+
+@functools.lru_cache(maxsize=64)
+def _ema(csv_path, span):
+    # 收盘价的EMA只跟span有关, 1890组参数里最多算 5 + 6 = 11 次
+    return bt_ema(_load(csv_path)['close'], span)
+
+
+@functools.lru_cache(maxsize=256)
+def _macd_cross(csv_path, fast, slow, signal):
+    # 每个 (fast, slow, signal) 的交叉信号只算一次, 止盈止损参数共用
+    macd = _ema(csv_path, fast) - _ema(csv_path, slow)
+    return bt_crossover(macd, bt_ema(macd, signal)).to_numpy()
+
+
+def screen_grid(csv_path):
+    ''' 不用Backtrader, 用numpy一次性把1890组参数都粗算一遍.
+    买卖规则和MACD_strategy一样: 信号出现后下一根K线开盘成交, 钱不够的买单作废. '''
+    df = _load(csv_path)
+    close = df['close'].to_numpy()
+    open_price = df['open'].to_numpy()
+    combos = list(itertools.product(*PARAM_GRID.values()))
+
+    cross = np.empty((len(combos), len(close)))
+    start = np.empty(len(combos), dtype=int)
+    for i, (fast, slow, signal, take_profit, stop_loss) in enumerate(combos):
+        cross[i] = _macd_cross(csv_path, fast, slow, signal)
+        start[i] = slow + signal - 1      # 和Backtrader一样, 指标都准备好了才开始调用next
+
+    take_profit = np.array([c[3] for c in combos])
+    stop_loss = np.array([c[4] for c in combos])
+
+    # 每组参数的状态都放在数组里, 每根K线所有参数一起算
+    cash = np.full(len(combos), float(CASH))
+    in_position = np.zeros(len(combos), dtype=bool)
+    buy_order = np.zeros(len(combos), dtype=bool)
+    sell_order = np.zeros(len(combos), dtype=bool)
+    buy_price = np.ones(len(combos))
+
+    for t in range(len(close)):
+        if t > 0:
+            # 上一根K线下的单, 这根K线开盘成交
+            # 买单: 下单时按收盘价检查一次资金, 成交时按开盘价再检查一次
+            check_cost = STAKE * close[t - 1] * (1 + COMMISSION)
+            cost = STAKE * open_price[t] * (1 + COMMISSION)
+            filled = buy_order & (cash >= check_cost) & (cash >= cost)
+            cash[filled] -= cost
+            in_position |= filled
+
+            cash[sell_order] += STAKE * open_price[t] * (1 - COMMISSION)
+            in_position &= ~sell_order
 
+        active = t >= start
+        change = (close[t] - buy_price) / buy_price
 
-    cerebro.broker.setcash(10000)
-    cerebro.broker.setcommission(commission=0.01)
-    cerebro.addsizer(bt.sizers.FixedSize, stake=100)
+        buy_order = active & ~in_position & (cross[:, t] > 0)      # 交叉买入
+        buy_price[buy_order] = close[t]
+        sell_order = active & in_position & ((cross[:, t] < 0) | (change >= take_profit) | (change <= -stop_loss))
 
-    cerebro.run(maxcpus=1)
+    final_value = cash + in_position * STAKE * close[-1]
+
+    results = pd.DataFrame(combos, columns=list(PARAM_GRID.keys()))
+    results['Final Value'] = final_value
+    return results
+
+
+def run_backtest(data, params):
+    cerebro = bt.Cerebro()
+    cerebro.adddata(data)
+    cerebro.addstrategy(MACD_strategy, **params)
+    cerebro.broker.setcash(CASH)
+    cerebro.broker.setcommission(commission=COMMISSION)
+    cerebro.addsizer(bt.sizers.FixedSize, stake=STAKE)
+    cerebro.run()
+    return cerebro.broker.getvalue()
+
+
+def run_testing(top_k=10):
+    csv_path = './DIS_year_data.csv'
+
+    # 第一步: 用numpy粗算全部参数组合
+    screened = screen_grid(csv_path)
+
+    # 第二步: 只有最好的top_k组再用Backtrader完整回测一次, 以Backtrader的结果为准
+    top = screened.sort_values('Final Value', ascending=False, kind='stable').head(top_k).sort_index()
+    data = DirectData(dataname=_load(csv_path))
+    results = []    # 把优化参数数据存储到这里来
+    for params in top.drop(columns='Final Value').to_dict('records'):
+        params = {k: (int(v) if k in ('fast', 'slow', 'signal') else v) for k, v in params.items()}
+        params['Final Value'] = run_backtest(data, params.copy())
+        results.append(params)
 
     #优化参数太多, 绘制图只能绘制一个.
     # cerebro.plot()
@@ -108,11 +164,3 @@ def run_testing():
 # 忘记调用
 if __name__ == "__main__":
     run_testing()
-
-
-
-
-
-
-
-
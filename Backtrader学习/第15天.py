@@ -9,66 +9,73 @@
 '''
 
 # 先导入库
+import argparse
 import backtrader as bt
-import pandas as pd
+import numpy as np
+from data_loader import load_df, add_macd, bt_rsi, bt_sma, DirectData
 
 
-# 加载数据
-def load_data():
-    file_path = './AI_year_data.csv'          # 我这边可以改是因为我有保存这些股票的数据.
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
+# 先用pandas把SMA, MACD, 成交量均线, 和RSI一次性算好, 再合成买入和卖出信号
+def add_signals(df, sma_short=10, sma_long=50, volume_sma_period=20, rsi_period=14, rsi_sell=70):
+    close = df['close']
 
-    print(df.head())
+    # SMA 均线 (SMA 10日, SMA 50日 长线); 用bt_sma和bt.SMA算得一模一样, 两条均线相等时金叉死叉不会判断错
+    short = bt_sma(close, sma_short)
+    long = bt_sma(close, sma_long)
+
+    # MACD 柱状图
+    hist = add_macd(df)['hist']
+
+    # RSI 14日线
+    rsi = bt_rsi(close, rsi_period)      # 有TA-Lib时用talib.RSI
+    df['rsi'] = rsi
+
+    # 成交量均线20日
+    volume_sma = df['volume'].rolling(volume_sma_period).mean()
+
+    # 买入条件
+    sma_cross = (short > long) & (short.shift() <= long.shift())
+    macd_turn_up = (hist > 0) & (hist.shift() <= 0)
+    volume_up = df['volume'] > volume_sma
+    rsi_ok = (rsi > 40) & (rsi < 60)
+    df['buy_sig'] = (sma_cross & (macd_turn_up | volume_up)).astype(np.float64)     # SMA_Cross 是主交易, ()里面是辅助交易
+
+    # 卖出条件
+    dead_cross = (short < long) & (short.shift() >= long.shift())
+    macd_turn_down = (hist < 0) & (hist.shift() >= 0)
+    rsi_toohigt = rsi > rsi_sell       # RSI >70 以上卖
+    df['sell_sig'] = (dead_cross | macd_turn_down | rsi_toohigt).astype(np.float64)
+    return df
+
+# 带有买卖信号的数据
+class SignalData(DirectData):
+    lines = ('buy_sig', 'sell_sig', 'rsi')
+    params = (('buy_sig', -1), ('sell_sig', -1), ('rsi', -1))
 
-    data = bt.feeds.PandasData(dataname=df)
-    return data
 
-# 添加SMA, MACD, 成交量均线, 和RSI策略
+# 用SMA, MACD, 成交量均线, 和RSI合成的信号交易
 class Multi_Strategy(bt.Strategy):
     params = (
-        ('sma_short', 10),      # SMA 10日
-        ('sma_long', 50),       # SMA 50日 长线
-        ('volume_sma_period', 20),   # 成交量均线20日
-        ('rsi_period', 14),      # RSI 14日线
-        ('rsi_sell', 70),        # RSI >70 以上卖
         ('take_profit', 0.2),   # 止盈20%
         ('stop_loss', 0.05)     # 止损5%
     )
 
     def __init__(self):
-        # SMA 均线
-        self.sma_short = bt.indicators.SMA(self.data.close, period=self.params.sma_short)
-        self.sma_long = bt.indicators.SMA(self.data.close, period=self.params.sma_long)
-
-        # MACD 柱状图
-        self.macd = bt.indicators.MACD(self.data.close)
-        self.macd_hist = self.macd.macd - self.macd.signal
-
-        # RSI
-        self.rsi = bt.indicators.RSI(self.data.close, period=self.params.rsi_period)
-
-        # 成交量均线
-        self.volume_sma = bt.indicators.SMA(self.data.volume, period=self.params.volume_sma_period)
+        # 买卖信号已经在add_signals里算好了, 每根K线只要看一下
+        self.buy_sig = self.data.buy_sig
+        self.sell_sig = self.data.sell_sig
 
         self.buy_price = None
 
     def next(self):
+        current_price = self.data.close[0]      # 只取一次当前价格
         if not self.position:
             # 买入条件
-            sma_cross = self.sma_short[0] > self.sma_long[0] and self.sma_short[-1] <= self.sma_long[-1]
-            macd_turn_up = self.macd_hist[0] > 0 and self.macd_hist[-1] <= 0
-            volume_up = self.data.volume[0] > self.volume_sma[0]
-            rsi_ok = self.rsi[0] > 40 and self.rsi[0] < 60
-
-            if sma_cross and (macd_turn_up or volume_up):       # SMA_Cross 是主交易, ()里面是辅助交易
+            if self.buy_sig[0]:
                 self.buy()
-                self.buy_price = self.data.close[0]     # 记录买入价格
+                self.buy_price = current_price     # 记录买入价格
         else:
             # 当前涨跌幅
-            current_price = self.data.close[0]
             price_change = (current_price - self.buy_price) / self.buy_price
 
             # 止盈条件
@@ -86,17 +93,15 @@ class Multi_Strategy(bt.Strategy):
 
 
             # 卖出条件
-            dead_cross = self.sma_short[0] < self.sma_long[0] and self.sma_short[-1] >= self.sma_long[-1]
-            macd_turn_down = self.macd_hist[0] < 0 and self.macd_hist[-1] >= 0
-            rsi_toohigt = self.rsi[0] > self.params.rsi_sell
-
-            if dead_cross or macd_turn_down or rsi_toohigt:
+            if self.sell_sig[0]:
                 self.sell()
                 self.buy_price = None
 
-def run_testing():
+def run_testing(plot=False):
     cerebro = bt.Cerebro()
-    data = load_data()      # 需要调用
+    df = load_df('./AI_year_data.csv')      # 需要调用  我这边可以改是因为我有保存这些股票的数据.
+    print(df.head())
+    data = SignalData(dataname=add_signals(df))
     cerebro.adddata(data)
     cerebro.addstrategy(Multi_Strategy)     # 需要加入策略, 不然就一直卡.
 
@@ -108,9 +113,13 @@ def run_testing():
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue():.2f}")
 
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 # 调用
 if __name__ == "__main__":
-    run_testing()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testing(plot=args.plot)
 
@@ -11,19 +11,33 @@
 '''
 
 
+import argparse
 import backtrader as bt
-import pandas as pd
-
-# 加载数据
-def load_data():
-    file_path = './BABA_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
-
-    data = bt.feeds.PandasData(dataname=df)
-    return data
+import numpy as np
+# numba 可以把循环编译成机器码. 没有安装的话就用numpy的convolve
+from data_loader import load_data, njit, HAS_NUMBA
+
+
+# 先找提前编译好的 kernels 模块 (python kernels_aot.py 生成), 不用运行时再编译
+try:
+    from kernels import wma_f64
+    HAS_KERNELS = True
+except ImportError:
+    HAS_KERNELS = False
+
+
+# WMA 计算核心: 一次算完整条价格的加权平均
+@njit(cache=True)       # cache=True 把编译结果存起来, 下次运行不用再编译
+def _wma_loop(closes, period):
+    n = closes.shape[0]
+    out = np.full(n, np.nan)        # 前面 period-1 天数据不够, 保持nan
+    denom = period * (period + 1) / 2       # 权重总和: 1+2+...+period
+    for i in range(period - 1, n):
+        acc = 0.0
+        for k in range(period):
+            acc += closes[i - period + 1 + k] * (k + 1)     # 最旧的价格乘以最小的权重
+        out[i] = acc / denom
+    return out
 
 # 自定义指标
 class WeightMovingAverage(bt.Indicator):
@@ -32,37 +46,28 @@ class WeightMovingAverage(bt.Indicator):
 
     def __init__(self):
         # 构造权重:
-        weights = list(range(1, self.p.period + 1))     # 权重从1 到period: 权重=[1,2,3,4,5,6,7,8,9,10]
-        total_weight = sum(weights)         #权重总和
-
-        # 一个个除以总和, 得到归一化的权重(加起来等于1)
-        normalized_weights = []
-        for w in weights:
-            normalized_weights.append(w / total_weight)
+        weights = np.arange(1, self.p.period + 1, dtype=np.float64)     # 权重从1 到period: 权重=[1,2,3,4,5,6,7,8,9,10]
+        weights /= weights.sum()        # 除以权重总和, 得到归一化的权重(加起来等于1)
 
         # 存储到self.weights
-        self.weights = normalized_weights
+        self.weights = weights
+
+        # 数据已经预先加载好了, 一次性把整条收盘价拿出来算好WMA, 不用每根K线再循环
+        closes = np.asarray(self.data.close.array, dtype=np.float64)
+        if HAS_KERNELS:
+            self._wma = wma_f64(closes, self.p.period)
+        elif HAS_NUMBA:
+            self._wma = _wma_loop(closes, self.p.period)
+        else:
+            wma = np.full(len(closes), np.nan)
+            if len(closes) >= self.p.period:
+                # convolve 会把权重反过来用, 所以先反转一次: 最旧的价格乘以最小的权重
+                wma[self.p.period - 1:] = np.convolve(closes, weights[::-1], mode='valid')
+            self._wma = wma
 
     def next(self):
-        if len(self.data) >= self.p.period:     # 如果数据的长度 还不够计算, 就不要算
-
-            # 取出最近几天的价格
-            recent_price = list(self.data.get(size=self.p.period))
-
-            # 创建一个空列表. 用来放每个价格乘以权重的结果
-            weighted_prices = []
-
-            # 把每个价格和对应的权重相乘
-            for i in range(self.p.period):
-                price = recent_price[i]
-                weight = self.weights[i]
-                weighted_prices.append(price * weight)
-
-            # 所有乘积加起来, 得到加权平均值
-            wma_value = sum(weighted_prices)
-
-            # 把结果保存到输出线上
-            self.lines.wma[0] = wma_value
+        # 直接取出已经算好的值, 保存到输出线上
+        self.lines.wma[0] = self._wma[len(self) - 1]
 
 # 写一个策略来验证自定义的wma
 class Test_WMA_Strategy(bt.Strategy):
@@ -75,7 +80,7 @@ class Test_WMA_Strategy(bt.Strategy):
             return
 
         # 打印当前时间和wma的值
-        dt = self.data.datetime.date(0)
+        dt = self.data.current_date()
         close = self.data.close[0]
         wma_val = self.wma[0]
         print(f"{dt} | 收盘价: {close:.2f} | WMA: {wma_val:.2f}")
@@ -98,10 +103,13 @@ class Test_WMA_Strategy(bt.Strategy):
 
 # 运行回测构架
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
     cerebro = bt.Cerebro()
     cerebro.addstrategy(Test_WMA_Strategy)
 
-    data = load_data()
+    data = load_data('./BABA_year_data.csv')
     cerebro.adddata(data)
 
     cerebro.broker.setcash(10000)
@@ -111,7 +119,8 @@ if __name__ == "__main__":
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue():.2f}")
 
-    cerebro.plot()
+    if args.plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 
 
@@ -10,22 +10,11 @@
     运行回测并分析多周期信号带来的策略变化。
 '''
 
+import argparse
 import backtrader as bt
-import pandas as pd
-from trio import sleep
+from data_loader import load_data
 
 
-# 加载数据
-def load_data():
-    file_path = './ALHC_year_data.csv'
-    df = pd.read_csv(file_path)     # 读取数据
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
-
-    data = bt.feeds.PandasData(dataname=df)
-    return data
-
 class MultiTimeFrameStrategy(bt.Strategy):
     params = (
         ('take_profit', 0.10),       # 止盈10%
@@ -40,13 +29,13 @@ class MultiTimeFrameStrategy(bt.Strategy):
         self.buy_price = None   #初始化买入价格
 
     def next(self):
+        # 当前价格
+        current_price = self.datas[0].close[0]
         if not self.position:
-            if (self.datas[0].close[0] > self.daily_sma[0]) or (self.datas[1].close[0] > self.weekly_sma[0]):
+            if (current_price > self.daily_sma[0]) or (self.datas[1].close[0] > self.weekly_sma[0]):
                 self.buy()
-                self.buy_price = self.datas[0].close[0] # 记录买入价格
+                self.buy_price = current_price # 记录买入价格
         else:
-            # 当前价格
-            current_price = self.datas[0].close[0]
             if self.buy_price:
                 profit_pct = (current_price - self.buy_price) / self.buy_price
 
@@ -67,14 +56,14 @@ class MultiTimeFrameStrategy(bt.Strategy):
             #     self.buy_price = None
 
     def log(self, txt):
-        dt = self.datas[0].datetime.date(0)
-        print(f"{dt.isoformat()} - {txt}")
+        dt = self.datas[0].current_date()
+        print(f"{dt} - {txt}")
 
-def run_testing():
+def run_testing(plot=False):
     cerebro = bt.Cerebro()
     cerebro.addstrategy(MultiTimeFrameStrategy)
 
-    data = load_data()
+    data = load_data('./ALHC_year_data.csv')
     cerebro.adddata(data)
 
     # 用resample 生成周线数据
@@ -89,10 +78,14 @@ def run_testing():
     print(f"初始资金: {cerebro.broker.getvalue():.2f}")
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue():.2f}")
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 if __name__ == "__main__":
-    run_testing()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testing(plot=args.plot)
 
 
 
@@ -10,18 +10,25 @@
     回测多数据策略，观察组合表现。
 '''
 
+import argparse
 import backtrader as bt
-import pandas as pd
+import numpy as np
+from data_loader import load_df, bt_sma, DirectData
 
 
+# 带有均线和信号的数据: sig = 1 收盘价在均线上面, -1 在均线下面, 0 均线还没算出来
+class SMAData(DirectData):
+    lines = ('sma', 'sig')
+    params = (('sma', -1), ('sig', -1), ('sma_period', 0))
+
+
+def load_data(file_path, name, sma_period):
+    # 均线用pandas一次算好, 不用Backtrader每根K线更新SMA指标
+    df = load_df(file_path)
+    df['sma'] = bt_sma(df['close'], sma_period)      # 和bt.SMA一样用fsum求和, 收盘价刚好等于均线时sig不会变
+    df['sig'] = np.sign(df['close'] - df['sma']).fillna(0).astype(np.int8)
+    return SMAData(dataname=df, name=name, sma_period=sma_period)
 
-# 加载函数
-def load_data(file_path, name):    # 这次要加载多个公司股票数据.
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
-    return bt.feeds.PandasData(dataname=df, name=name)
 
 # 策略
 class MultiStockStrategy(bt.Strategy):
@@ -32,32 +39,35 @@ class MultiStockStrategy(bt.Strategy):
         self.unh = self.getdatabyname('UNH')
         self.pltr = self.getdatabyname('PLTR')
 
-        # 为每只股票独立创建的指标
-        self.sma1 = bt.indicators.SMA(self.unh.close, period=5)
-        self.sma2 = bt.indicators.SMA(self.pltr.close, period=10)
+        # 每只股票的均线在load_data里已经算好了 (UNH 5日, PLTR 10日), 直接看sig
+        # 和原来用SMA指标时一样, 等最长的那条均线算好了才开始交易
+        self.warmup = max(d.p.sma_period for d in self.datas)
 
     def next(self):
+        if len(self) < self.warmup:
+            return
+
         # 处理UNH
         unh1 = self.getposition(self.unh).size
-        if not unh1 and self.unh.close[0] > self.sma1[0]:
+        if not unh1 and self.unh.sig[0] > 0:
             self.buy(data=self.unh)
-        elif unh1 and self.unh.close[0] < self.sma1[0]:
+        elif unh1 and self.unh.sig[0] < 0:
             self.sell(data=self.unh)
 
         # 处理 PLTR
         pltr1 = self.getposition(self.pltr).size
-        if not pltr1 and self.pltr.close[0] > self.sma2[0]:
+        if not pltr1 and self.pltr.sig[0] > 0:
             self.buy(data=self.pltr)
-        elif pltr1 and self.pltr.close[0] < self.sma2[0]:
+        elif pltr1 and self.pltr.sig[0] < 0:
             self.sell(data=self.pltr)
 
-def run_testing():
+def run_testing(plot=False):
     cerebro = bt.Cerebro()
     cerebro.addstrategy(MultiStockStrategy)
 
     # 加载两个不同的数据
-    data1 = load_data('./UNH_year_data.csv', 'UNH')
-    data2 = load_data('./PLTR_year_data.csv', 'PLTR')
+    data1 = load_data('./UNH_year_data.csv', 'UNH', 5)
+    data2 = load_data('./PLTR_year_data.csv', 'PLTR', 10)
 
     cerebro.adddata(data1)
     cerebro.adddata(data2)
@@ -70,10 +80,14 @@ def run_testing():
     print(f"初始资金: {cerebro.broker.getvalue():.2f}")
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue():.2f}")
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 if __name__ == "__main__":
-    run_testing()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testing(plot=args.plot)
 
 
 
@@ -10,19 +10,11 @@
     运行回测测试挂单和撤单机制的效果。
 '''
 
-import pandas as pd
+import argparse
 import backtrader as bt
 from datetime import timedelta
+from data_loader import load_data
 
-def load_data():
-    file_path = './UNH_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
-
-    data = bt.feeds.PandasData(dataname=df)
-    return data
 
 class LimitOrderStrategy(bt.Strategy):
     params = dict(
@@ -72,9 +64,9 @@ class LimitOrderStrategy(bt.Strategy):
             print(f"[{dt}] 订单被撤销或拒绝, 将再下一根K线重新挂单")
             self.order = None   # 清除订单记录以便下一次 next()重新挂单
 
-def run_testing():
+def run_testing(plot=False):
     cerebro = bt.Cerebro()
-    data = load_data()
+    data = load_data('./UNH_year_data.csv')
     cerebro.adddata(data)
     cerebro.addstrategy(LimitOrderStrategy)
     cerebro.broker.setcash(10000)
@@ -84,9 +76,13 @@ def run_testing():
     cerebro.run()
     print(f" 最终资金: {cerebro.broker.getvalue():.2f}")
 
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 if __name__ == "__main__":
-    run_testing()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testing(plot=args.plot)
 
 
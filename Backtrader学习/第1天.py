@@ -4,9 +4,11 @@
 	练习：编写一个简单的Backtrader脚本，和获取股票数据。
 '''
 
+import argparse
 import pandas as pd
 import backtrader as bt
 from yahooquery import Ticker
+from data_loader import DirectData
 
 class SMA(bt.Strategy):
     def __init__(self):
@@ -28,8 +30,8 @@ class SMA(bt.Strategy):
             elif order.issell():
                 print(f"卖出: {order.executed.price: .2f}")
 
-def run_backtesting():
-    ticker = input(f"请输入股票代码: ")
+def run_backtesting(ticker, plot=False):
+    # 股票代码从命令行 --ticker 传进来, 不用input, 可以不用人守着批量跑
     stock = Ticker(ticker)
     data = stock.history(start='2024-08-05', end='2025-05-05')
 
@@ -41,7 +43,7 @@ def run_backtesting():
 
     cerebro = bt.Cerebro()
     cerebro.addstrategy(SMA)
-    df = bt.feeds.PandasData(dataname=data)
+    df = DirectData(dataname=data)
     cerebro.adddata(df)
     cerebro.broker.setcash(10000)
     cerebro.broker.setcommission(commission=0.001)
@@ -52,7 +54,12 @@ def run_backtesting():
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue(): .2f}")
 
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 if __name__ == "__main__":
-    run_backtesting()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ticker', default='AAPL', help='股票代码')
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_backtesting(args.ticker, plot=args.plot)
@@ -12,24 +12,102 @@
 
 
 # 需要导入库
+import argparse
+import functools
+import itertools
+import os
+import numpy as np
 import pandas as pd
 import backtrader as bt
 
 ''' 添加时间'''
 import time
+from concurrent.futures import ThreadPoolExecutor
+# numba 可以把循环编译成机器码. 没有安装的话 njit 什么都不做, 直接用Python循环
+from data_loader import load_data, load_df, bt_ema, njit, HAS_NUMBA
 
-def load_data():
-    file_path = './BABA_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
-    df['openinterest'] = 0
+# joblib 在Python这一层把每组参数分给多个进程, 只传参数和结果, 不用optstrategy每组都pickle整个cerebro.
+# 没有安装的话还是用optstrategy
+try:
+    from joblib import Parallel, delayed
+    HAS_JOBLIB = True
+except ImportError:
+    HAS_JOBLIB = False
 
-    data = bt.feeds.PandasData(dataname=df)
-    return data
+# optuna 的TPE(贝叶斯)搜索不用把每组参数都跑一遍. 没有安装的话只能用网格搜索
+try:
+    import optuna
+    HAS_OPTUNA = True
+except ImportError:
+    HAS_OPTUNA = False
+
+
+# 一次循环算出整段的买卖信号: 1=买入, -1=卖出, 0=不动
+@njit(nogil=True, cache=True)       # cache=True 编译结果存在__pycache__里, 多进程优化时每个进程不用再编译
+def macd_signals(macd, signal, start):
+    n = macd.shape[0]
+    out = np.zeros(n, dtype=np.int8)
+    position = 0
+    last_diff = 0.0     # 和 bt.indicators.CrossOver 一样, 跟上一个不为0的差值比较
+    for i in range(n):
+        diff = macd[i] - signal[i]
+        if np.isnan(diff):
+            continue
+        cross = 0
+        if last_diff < 0 and diff > 0:
+            cross = 1
+        elif last_diff > 0 and diff < 0:
+            cross = -1
+        if diff != 0:
+            last_diff = diff
+
+        if i < start:       # 指标还没算好, 不交易
+            continue
+        if position == 0 and cross > 0:
+            out[i] = 1
+            position = 1
+        elif position == 1 and cross < 0:
+            out[i] = -1
+            position = 0
+    return out
+
+
+# 不用Backtrader, 一次循环算出一组参数的期末资金. 规则和Backtrader一样: 信号出现后下一根K线开盘成交,
+# 每次买卖 stake 股, 手续费按成交额收, 最后一根K线下的单不会成交. 10股一千多块, 资金一直够, 不会有买单被拒绝.
+# nogil=True: 运行时放开GIL, 多个线程可以真正同时跑, 共用同一份价格数组, 不用pickle
+@njit(nogil=True, cache=True)
+def backtest_kernel(macd, signal, start, open_price, close, cash, commission, stake):
+    signals = macd_signals(macd, signal, start)
+    n = close.shape[0]
+    position = 0
+    for i in range(n - 1):
+        if signals[i] > 0 and position == 0:
+            price = open_price[i + 1]
+            cash -= stake * price
+            cash -= stake * price * commission
+            position = stake
+        elif signals[i] < 0 and position > 0:
+            price = open_price[i + 1]
+            cash += position * price
+            cash -= position * price * commission
+            position = 0
+    return cash + position * close[n - 1]
+
+
+# 36组参数用的是同一段收盘价, 同一个周期的EMA只算一次 (4个fast + 3个slow = 7次, 不是72次).
+# key 用收盘价的bytes, 不用id(数组): 每次回测数组可能是新建的, id也可能被别的对象重复使用.
+# 多进程时每个进程有自己的缓存
+@functools.lru_cache(maxsize=64)
+def cached_ema(close_bytes, span):
+    return bt_ema(pd.Series(np.frombuffer(close_bytes)), span).to_numpy()
+
+
+@functools.lru_cache(maxsize=256)
+def cached_macd(close_bytes, fast, slow, signal):
+    # 返回 (macd线, 信号线), 数组是共用的, 不要修改
+    macd = cached_ema(close_bytes, fast) - cached_ema(close_bytes, slow)
+    return macd, bt_ema(pd.Series(macd), signal).to_numpy()
 
-# 用来收集所有回测结果
-results = []            # 把results放到全局变量
 
 class MACD(bt.Strategy):
     params = (
@@ -39,37 +117,44 @@ class MACD(bt.Strategy):
     )
 
     def __init__(self):
-        self.macd = bt.indicators.MACD(
-            self.data.close,
-            period_me1=self.p.fast,
-            period_me2=self.p.slow,
-            period_signal=self.p.signal
-        )
-        self.crossover = bt.indicators.CrossOver(self.macd.macd, self.macd.signal)
+        # 数据已经预先加载好了, MACD从缓存里取(没有就用pandas一次算好), 买卖信号用macd_signals一次算好, 不用Backtrader每根K线再算
+        close = np.asarray(self.data.close.array, dtype=np.float64)
+        macd, signal = cached_macd(close.tobytes(), self.p.fast, self.p.slow, self.p.signal)
+
+        # 和原来的MACD指标一样, 要 slow + signal 根K线才算好, 之前不交易
+        self.signals = macd_signals(macd, signal, self.p.slow + self.p.signal - 1)
 
     def next(self):
+        trade = self.signals[len(self) - 1]
         if not self.position: # 如果没有建仓
-            if self.crossover > 0:
+            if trade > 0:
                 self.buy()
-        elif self.crossover < 0:
+        elif trade < 0:
             self.close()
 
     def stop(self):
         pnl = round(self.broker.getvalue() - self.broker.startingcash, 2)
-        results.append({
-            'fast': self.p.fast,
-            'slow': self.p.slow,
-            'signal': self.p.signal,
-            'pnl': pnl,
-            '开始日期': self.data.datetime.date(0),
-            '结束日期': self.data.datetime.date(-1)         # 把回测日期输出到results里
-        })
         print(f' Fast: {self.p.fast}, Slow: {self.p.slow}, Signal: {self.p.signal}, pnl: {pnl}')
 
-def run_testing():
-    global results
+
+# 多进程优化时全局变量results传不回主进程, 改用分析器把每组的结果带回来
+class PnLAnalyzer(bt.Analyzer):
+    def stop(self):
+        self.rets['pnl'] = round(self.strategy.broker.getvalue() - self.strategy.broker.startingcash, 2)
+        self.rets['开始日期'] = self.data.datetime.date(0)
+        self.rets['结束日期'] = self.data.datetime.date(-1)        # 把回测日期输出到results里
+
+CSV_PATH = './BABA_year_data.csv'
+
+# 参数网格
+FAST_RANGE = range(10, 17, 2)       # 10, 12, 14, 16
+SLOW_RANGE = range(20, 31, 5)       # 20, 25, 30
+SIGNAL_RANGE = range(6, 13, 3)      # 6, 9, 12
+
+def run_optstrategy():
+    # 用Backtrader自己的optstrategy跑全部参数组合, 返回 {(fast, slow, signal): 分析结果}
     cerebro = bt.Cerebro()
-    data = load_data()
+    data = load_data(CSV_PATH)
     cerebro.adddata(data)
     cerebro.broker.setcash(10000)
     cerebro.broker.setcommission(commission=0.01)
@@ -77,25 +162,84 @@ def run_testing():
 
     cerebro.optstrategy(
         MACD,
-        fast=range(10, 17, 2),           # 10, 12, 14, 16
-        slow = range(20, 31, 5),         # 20, 25, 30
-        signal=range(6, 13, 3)           # 6, 9, 12
+        fast=FAST_RANGE,
+        slow=SLOW_RANGE,
+        signal=SIGNAL_RANGE
     )
 
-    ''' 我把results改成全局变量.  就不需要用MACD调用results.  只要results就新. '''
-    # 要先run, 之后再保存到results里.
-    results.clear()        # 先清空, 确保运行干净
+    cerebro.addanalyzer(PnLAnalyzer, _name='pnl')
+
+    # 每组参数互不影响, 用所有CPU一起跑. optreturn=True 只把参数和分析器传回来
+    opt_runs = cerebro.run(maxcpus=os.cpu_count(), optreturn=True)
+    return {(run[0].p.fast, run[0].p.slow, run[0].p.signal): run[0].analyzers.pnl.get_analysis() for run in opt_runs}
+
+
+def run_combo(csv_path, fast, slow, signal):
+    # joblib 的每个进程跑一组参数; 数据在进程里自己读, 同一个进程里csv只读一次
+    return single_run(load_data(csv_path), fast, slow, signal)
+
+
+def run_threads(combos):
+    # 用线程池跑 backtest_kernel, 返回和PnLAnalyzer一样的结果
+    df = load_df(CSV_PATH)
+    close = df['close'].to_numpy()
+    open_price = df['open'].to_numpy()
+    dates = df.index.date
+
+    # MACD线用pandas算, 要GIL, 先在主线程从缓存里取好; 线程里只跑numba
+    close_bytes = close.tobytes()
+    lines = [cached_macd(close_bytes, *combo) for combo in combos]
+
+    def run(i):
+        fast, slow, signal = combos[i]
+        macd, signal_line = lines[i]
+        return backtest_kernel(macd, signal_line, slow + signal - 1, open_price, close, 10000.0, 0.01, 10)
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        values = list(ex.map(run, range(len(combos))))
+
+    analyses = []
+    for (fast, slow, signal), value in zip(combos, values):
+        pnl = round(value - 10000, 2)
+        print(f' Fast: {fast}, Slow: {slow}, Signal: {signal}, pnl: {pnl}')
+        # 日期和PnLAnalyzer一样: 最后一根K线的日期 和 前一根的日期
+        analyses.append({'pnl': pnl, '开始日期': dates[-1], '结束日期': dates[-2]})
+    return analyses
+
+
+def run_testing(search='vector'):
+    combos = list(itertools.product(FAST_RANGE, SLOW_RANGE, SIGNAL_RANGE))
 
     start = time.time()
-    cerebro.run(maxcpus=1)      # 再运行
+    if search == 'vector':
+        analyses = run_threads(combos)
+    elif HAS_JOBLIB:
+        # 结果和combos的顺序一样
+        analyses = Parallel(n_jobs=-1)(delayed(run_combo)(CSV_PATH, *combo) for combo in combos)
+    else:
+        by_combo = run_optstrategy()
+        analyses = [by_combo[combo] for combo in combos]
     print(f'参数优化完成, 用时: {round(time.time() - start, 2)}秒')
 
+    # 结果按参数组合的顺序放进事先分配好的数组里, 不用一个个dict再转DataFrame
+    fast_arr, slow_arr, signal_arr = np.array(combos, dtype=np.int16).T
+    pnl_arr = np.empty(len(combos))         # pnl 保持float64, float32 保存到csv会变成 632.5399780273438
+    start_dates = np.empty(len(combos), dtype=object)
+    end_dates = np.empty(len(combos), dtype=object)
+
+    # 要先run, 之后再保存到results里.
+    for i, analysis in enumerate(analyses):
+        pnl_arr[i] = analysis['pnl']
+        start_dates[i] = analysis['开始日期']
+        end_dates[i] = analysis['结束日期']
+
     # 分析最佳参数
-    df = pd.DataFrame(results)
+    best = np.argmax(pnl_arr)
+    df = pd.DataFrame({'fast': fast_arr, 'slow': slow_arr, 'signal': signal_arr, 'pnl': pnl_arr,
+                       '开始日期': start_dates, '结束日期': end_dates})
     print(df.head())        # 打印看看内容
-    best = df.sort_values(by='pnl', ascending=False).iloc[0]
     print(f"最佳参数组合")
-    print(f"{len(results)}组 => Fast: {best['fast']}, Slow: {best['slow']}, Signal: {best['signal']}, pnl: {best['pnl']}")
+    print(f"{len(combos)}组 => Fast: {fast_arr[best]}, Slow: {slow_arr[best]}, Signal: {signal_arr[best]}, pnl: {pnl_arr[best]}")
 
     #  保存优化结果
     df.to_csv('./BABA_MACD_优化结果.csv', index=False, encoding='utf-8-sig')        # ./ 这是添加到目录里
@@ -104,6 +248,48 @@ def run_testing():
 
     # cerebro.plot()    # 优化不能绘制图
 
+def single_run(data, fast, slow, signal):
+    # 用一组参数单独跑一次回测, 返回PnLAnalyzer的结果 (pnl 和开始结束日期)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(data)
+    cerebro.addstrategy(MACD, fast=fast, slow=slow, signal=signal)
+    cerebro.broker.setcash(10000)
+    cerebro.broker.setcommission(commission=0.01)
+    cerebro.addsizer(bt.sizers.FixedSize, stake=10)
+    cerebro.addanalyzer(PnLAnalyzer, _name='pnl')
+    strat = cerebro.run()[0]
+    return strat.analyzers.pnl.get_analysis()
+
+def run_tpe(n_trials=30):
+    ''' 用optuna的TPE搜索, 每次根据之前的结果挑下一组参数, 不用36组全部跑完 '''
+    data = load_data(CSV_PATH)
+
+    def objective(trial):
+        fast = trial.suggest_int('fast', 10, 16, step=2)
+        slow = trial.suggest_int('slow', 20, 30, step=5)
+        signal = trial.suggest_int('signal', 6, 12, step=3)
+        return single_run(data, fast, slow, signal)['pnl']
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)      # 不打印每一次的日志
+    start = time.time()
+    study = optuna.create_study(direction='maximize')
+    study.optimize(objective, n_trials=n_trials)
+    print(f'参数优化完成, 用时: {round(time.time() - start, 2)}秒')
+
+    best = study.best_params
+    print(f"最佳参数组合")
+    print(f"{n_trials}次 => Fast: {best['fast']}, Slow: {best['slow']}, Signal: {best['signal']}, pnl: {study.best_value}")
+
 # 忘记调用了
 if __name__ == "__main__":
-    run_testing()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--search', choices=['vector', 'grid', 'tpe'], default='vector',
+                        help='参数搜索方法: numba线程池网格 或 Backtrader网格 或 TPE')
+    parser.add_argument('--trials', type=int, default=30, help='TPE 搜索的次数')
+    args = parser.parse_args()
+    if args.search == 'tpe' and HAS_OPTUNA:
+        run_tpe(args.trials)
+    else:
+        if args.search == 'tpe':
+            print("没有安装optuna, 改用网格搜索")
+        run_testing('grid' if args.search == 'grid' else 'vector')
\ No newline at end of file
@@ -3,9 +3,11 @@
 	设计一个双均线策略的backtrader，定义买卖规则。
 '''
 
+import argparse
 from yahooquery import Ticker
 import pandas as pd
 import backtrader as bt
+from data_loader import DirectData
 
 class EMA(bt.Strategy):
     def __init__(self):
@@ -22,8 +24,8 @@ class EMA(bt.Strategy):
               or self.crossover[0] == -1 or self.data.close[0] < self.crossover[0]):
             self.sell()
 
-def run_backtesting():
-    ticker = input(f"请输入股票代码: ")
+def run_backtesting(ticker, plot=False):
+    # 股票代码从命令行 --ticker 传进来, 不用input, 可以不用人守着批量跑
     stock = Ticker(ticker)
     df = stock.history(start='2024-05-05', end='2025-05-05')
     df = df.reset_index()
@@ -35,7 +37,7 @@ def run_backtesting():
     cerebro = bt.Cerebro()
     cerebro.addstrategy(EMA)
 
-    data = bt.feeds.PandasData(dataname=df)
+    data = DirectData(dataname=df)
     cerebro.adddata(data)
 
     cerebro.broker.setcash(10000)
@@ -47,8 +49,13 @@ def run_backtesting():
     cerebro.run()
     print(f"最终资金: {cerebro.broker.getvalue():.2f}")
 
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 
 if __name__ == "__main__":
-    run_backtesting()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ticker', default='AAPL', help='股票代码')
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_backtesting(args.ticker, plot=args.plot)
@@ -3,9 +3,11 @@
 	练习：实现双均线策略, 用backtrader库，设置短期和长期均线。
 '''
 
+import argparse
 import pandas as pd
 import backtrader as bt
 from yahooquery import Ticker
+from data_loader import run_vectorized, DirectData
 
 class DoubleMA_Strategy(bt.Strategy):
     params = (
@@ -24,8 +26,8 @@ class DoubleMA_Strategy(bt.Strategy):
         elif self.short_ma[0] < self.long_ma[0]:
             self.sell()
 
-def run_backtesting():
-    ticker = input(f"请输入股票: ")
+def run_backtesting(ticker, plot=False):
+    # 股票代码从命令行 --ticker 传进来, 不用input, 可以不用人守着批量跑
     stock = Ticker(ticker)
     df = stock.history(period='1y')
     df = df.reset_index()
@@ -33,13 +35,23 @@ def run_backtesting():
     df.columns = ['datetime', 'open', 'high', 'low', 'close', 'volume']
 
     # 时间混乱, 需要改.
+    # yahooquery 给的是 date 对象, 最后一天盘中还会混进一个带时区的时间, 不是字符串, 所以写format没有用;
+    # 必须 utc=True 统一时区再去掉时区, 不然会报 Mixed timezones
     df['datetime'] = pd.to_datetime(df['datetime'], utc=True).dt.tz_localize(None)
     df.set_index('datetime', inplace=True)
 
+    # 不画图的话用numpy直接算出结果, 和Backtrader跑出来的一样, 只是快很多
+    if not plot:
+        print(f'初始资金: {10000:.2f}')
+        final_value = run_vectorized(df, DoubleMA_Strategy.params.short_period, DoubleMA_Strategy.params.long_period,
+                                     cash=10000, commission=0.001, stake=100)
+        print(f'最终资金: {final_value:.2f}')
+        return
+
     cerebro = bt.Cerebro()
     cerebro.addstrategy(DoubleMA_Strategy)
 
-    data = bt.feeds.PandasData(dataname=df)
+    data = DirectData(dataname=df)
     cerebro.adddata(data)
     cerebro.broker.setcash(10000)
     cerebro.broker.setcommission(commission=0.001)
@@ -48,9 +60,13 @@ def run_backtesting():
     print(f'初始资金: {cerebro.broker.getvalue():.2f}')
     cerebro.run()
     print(f'最终资金: {cerebro.broker.getvalue():.2f}')
-    cerebro.plot()
+    cerebro.plot()      # 加上 --plot 才会走到这里
 
 if __name__ == "__main__":
-    run_backtesting()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ticker', default='AAPL', help='股票代码')
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_backtesting(args.ticker, plot=args.plot)
 
 
@@ -3,11 +3,14 @@
 	练习：运行回测脚本，获取策略的收益率曲线和统计指标。
 '''
 
+import argparse
+import numpy as np
 import pandas as pd
 import backtrader as bt
 from alpha_vantage.timeseries import TimeSeries
 from datetime import datetime
 import matplotlib.pyplot as plt
+from data_loader import DirectData
 
 
 def get_daily_data(symbol, API_Key):
@@ -20,7 +23,7 @@ def get_daily_data(symbol, API_Key):
         '4. close': 'Close',
         '5. volume': 'Volume'
     })
-    data.index = pd.to_datetime(data.index)
+    data.index = pd.to_datetime(data.index, format='%Y-%m-%d')      # 日期都是 2025-05-30 这种格式, 不用再猜
 
     one_year_ago = datetime.now() - pd.DateOffset(years=1)
     data = data[data.index >= one_year_ago]
@@ -31,10 +34,13 @@ class SMA_Strategy(bt.Strategy):
     def __init__(self):
         self.sma5 = bt.indicators.SMA(period=5)
         self.sma20 = bt.indicators.SMA(period=20)
-        self.portfolio_value = []       #   用于保存每日资金
+        # 用于保存每日资金: 数据已经预先加载好了, 按K线数量先分配好数组, 不用每天append
+        self.portfolio_value = np.empty(self.data.buflen())
+        self.idx = 0
 
     def next(self):
-        self.portfolio_value.append(self.broker.getvalue()) #每日资金变化
+        self.portfolio_value[self.idx] = self.broker.getvalue()     #每日资金变化; getvalue() 直接返回broker算好的值
+        self.idx += 1
         if not self.position:
             if self.sma5[0] > self.sma20[0]:
                 self.buy()
@@ -45,7 +51,7 @@ class SMA_Strategy(bt.Strategy):
     def stop(self):
         # 绘制收益率图
         plt.figure(figsize=(10, 5))
-        plt.plot(self.portfolio_value)
+        plt.plot(self.portfolio_value[:self.idx])      # 均线算好之前没有调用next, 只画填好的部分
         plt.title('Portfolio Value Over Time')
         plt.xlabel('day')
         plt.ylabel('Portfolio Value')
@@ -53,9 +59,9 @@ class SMA_Strategy(bt.Strategy):
         plt.tight_layout()
         plt.show()
 
-def run_testing():
+def run_testing(plot=False):
     data = get_daily_data(symbol, API_Key)
-    df = bt.feeds.PandasData(dataname=data)
+    df = DirectData(dataname=data)
 
     cerebro = bt.Cerebro()
     cerebro.addstrategy(SMA_Strategy)
@@ -88,10 +94,15 @@ def run_testing():
     print(f"亏损次数: {trades['lost']['total']}")
     print(f"胜率: {(trades['won']['total'] / trades['total']['total']): .2%}")
 
-    cerebro.plot()
+    if plot:    # 加上 --plot 才画图
+        cerebro.plot()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ticker', default='AAPL', help='股票代码')
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
     API_Key = 'LNCEEYGQUGYZCRGO'
-    symbol = input(f"请输入股票代码: ")
-    run_testing()
+    symbol = args.ticker        # 从命令行传进来, 不用input, 可以不用人守着批量跑
+    run_testing(plot=args.plot)
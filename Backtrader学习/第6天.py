@@ -3,8 +3,22 @@
 	优化策略参数，如短期和长期均线的周期。
 '''
 
+import argparse
+import numpy as np
 import pandas as pd
 import backtrader as bt
+from data_loader import read_price_csv, bt_rsi, DirectData
+
+# optuna 的TPE(贝叶斯)搜索不用把每组参数都跑一遍. 没有安装的话只能用网格搜索
+try:
+    import optuna
+    HAS_OPTUNA = True
+except ImportError:
+    HAS_OPTUNA = False
+
+# 网格搜索的参数范围, Backtrader 和 numpy 两种写法共用
+RSI_SHORT_RANGE = range(5, 16, 2)       # 测试5-15的短期周期，步长2
+RSI_LONG_RANGE = range(20, 41, 5)       # 测试20-40的长期周期，步长5
 
 
 class RsiStrategy(bt.Strategy):
@@ -16,58 +30,52 @@ class RsiStrategy(bt.Strategy):
     )
 
     def __init__(self):
-        # 计算两个RSI指标
-        self.rsi_short = bt.indicators.RSI(self.data.close, period=self.p.rsi_short)
-        self.rsi_long = bt.indicators.RSI(self.data.close, period=self.p.rsi_long)
+        # 数据已经预先加载好了, 两个RSI指标一次性用pandas算好, 不用Backtrader每根K线再算
+        close = pd.Series(np.asarray(self.data.close.array))
+        self.rsi_short = bt_rsi(close, self.p.rsi_short).to_numpy()
+        self.rsi_long = bt_rsi(close, self.p.rsi_long).to_numpy()
 
-        # 交叉信号
-        self.crossover = bt.indicators.CrossOver(self.rsi_short, self.rsi_long)
+        # 原来的RSI和交叉信号指标要 rsi_long + 2 根K线才算好, 之前不交易
+        self.warmup = self.p.rsi_long + 2
 
     def next(self):
+        if len(self) < self.warmup:
+            return
+
+        i = len(self) - 1
         # 简单的交叉策略
         if not self.position:
-            if self.rsi_short > self.rsi_long:  # 短期上穿长期
+            if self.rsi_short[i] > self.rsi_long[i]:  # 短期上穿长期
                 self.buy()
-        elif self.rsi_short < self.rsi_long:  # 短期下穿长期
+        elif self.rsi_short[i] < self.rsi_long[i]:  # 短期下穿长期
             self.close()
 
 
-def optimize_parameters():
-    # 1. 加载本地AAL数据
-    df = pd.read_csv('./AAL_year_data.csv', parse_dates=['date'], index_col='date')
-
-    # 2. 确保列名正确
-    df = df.rename(columns={
-        'Open': 'open', 'High': 'high',
-        'Low': 'low', 'Close': 'close',
-        'Volume': 'volume'
-    })
-
-    # 3. 创建回测引擎
+def grid_search(data):
+    # 2. 创建回测引擎
     cerebro = bt.Cerebro()
-    data = bt.feeds.PandasData(dataname=df)
     cerebro.adddata(data)
 
-    # 4. 设置优化参数范围
+    # 3. 设置优化参数范围
     cerebro.optstrategy(
         RsiStrategy,
-        rsi_short=range(5, 16, 2),  # 测试5-15的短期周期，步长2
-        rsi_long=range(20, 41, 5)  # 测试20-40的长期周期，步长5
+        rsi_short=RSI_SHORT_RANGE,
+        rsi_long=RSI_LONG_RANGE
     )
 
-    # 5. 回测设置
+    # 4. 回测设置
     cerebro.broker.setcash(10000)
     cerebro.broker.setcommission(commission=0.001)
 
-    # 6. 添加分析指标
+    # 5. 添加分析指标
     cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
     cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
 
-    # 7. 运行优化
+    # 6. 运行优化
     print("开始参数优化...")
     results = cerebro.run()
 
-    # 8. 分析优化结果
+    # 7. 分析优化结果
     best_sharpe = -float('inf')
     best_params = None
     results_list = []
@@ -92,8 +100,127 @@ def optimize_parameters():
                     'return': ret,
                     'sharpe': sharpe
                 }
+    return best_params, results_list
+
+
+def vector_backtest(df, rsi_short, rsi_long, warmup, cash=10000, commission=0.001):
+    ''' 不用Backtrader, 直接用numpy算出 RsiStrategy 每根K线收盘后的资金.
+    规则和Backtrader一样: 信号出现后下一根K线开盘成交, 每次买卖1股 (默认的sizer), 手续费按成交额收;
+    1股只要十几块钱, 资金一直够, 不会有买单被拒绝. rsi_short/rsi_long 是算好的RSI数组,
+    前 warmup 根K线不交易. '''
+    close = df['close'].to_numpy()
+    open_price = df['open'].to_numpy()
+    n = len(close)
+
+    # 最后一根K线下的单不会成交, 所以只看到倒数第二根
+    above = rsi_short[:-1] > rsi_long[:-1]
+    below = rsi_short[:-1] < rsi_long[:-1]
+    above[:warmup - 1] = False
+    below[:warmup - 1] = False
+
+    # 买卖点交替出现, 只循环交易次数: 每次找下一个成立的信号, 下一根K线开盘成交
+    flows = np.zeros(n)             # 每根K线现金的变化
+    position = np.zeros(n)          # 每根K线开盘成交后的持仓变化
+    t = 0
+    in_position = False
+    while t < n - 1:
+        hits = np.flatnonzero(below[t:] if in_position else above[t:])
+        if len(hits) == 0:
+            break
+        t = t + hits[0] + 1
+        if in_position:
+            flows[t] += open_price[t] * (1 - commission)
+            position[t] -= 1
+        else:
+            flows[t] -= open_price[t] * (1 + commission)
+            position[t] += 1
+        in_position = not in_position
+
+    return cash + np.cumsum(flows) + np.cumsum(position) * close
+
+
+def vector_analyze(df, values, cash=10000, riskfreerate=0.01):
+    # 和 bt.analyzers.Returns 一样: 总的对数收益平均到每根K线, 再按252天年化
+    rnorm100 = np.expm1(np.log(values[-1] / cash) / len(values) * 252) * 100
+
+    # 和 bt.analyzers.SharpeRatio 默认设置一样: 按年算收益率, 减去无风险利率, 除以标准差(不是样本标准差)
+    year_end = values[np.r_[np.flatnonzero(np.diff(df.index.year)), len(values) - 1]]
+    returns = year_end / np.r_[cash, year_end[:-1]] - 1 - riskfreerate
+    std = returns.std()
+    sharpe = returns.mean() / std if std else None
+    return rnorm100, sharpe
+
+
+def vector_grid_search(df):
+    # 每个周期的RSI只算一次, 30组参数共用
+    close = df['close']
+    rsis = {p: bt_rsi(close, p).to_numpy() for p in set(RSI_SHORT_RANGE) | set(RSI_LONG_RANGE)}
+
+    print("开始参数优化...")
+    best_params = None
+    results_list = []
+    for rsi_short in RSI_SHORT_RANGE:
+        for rsi_long in RSI_LONG_RANGE:
+            values = vector_backtest(df, rsis[rsi_short], rsis[rsi_long], warmup=rsi_long + 2)     # 和 RsiStrategy.warmup 一样
+            ret, sharpe = vector_analyze(df, values)
+            params = {'rsi_short': rsi_short, 'rsi_long': rsi_long, 'return': ret, 'sharpe': sharpe}
+            results_list.append(params)
+            # 选择夏普比率最高的参数
+            if best_params is None or sharpe > best_params['sharpe']:
+                best_params = params
+    return best_params, results_list
+
+
+def run_once(data, rsi_short, rsi_long):
+    # 用一组参数单独跑一次回测, 返回年化回报率和夏普比率
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(data)
+    cerebro.addstrategy(RsiStrategy, rsi_short=rsi_short, rsi_long=rsi_long)
+    cerebro.broker.setcash(10000)
+    cerebro.broker.setcommission(commission=0.001)
+    cerebro.addanalyzer(bt.analyzers.Returns, _name='returns')
+    cerebro.addanalyzer(bt.analyzers.SharpeRatio, _name='sharpe')
+    strat = cerebro.run()[0]
+    return strat.analyzers.returns.get_analysis()['rnorm100'], strat.analyzers.sharpe.get_analysis()['sharperatio']
+
+
+def tpe_search(data, n_trials):
+    # 每次根据之前的结果挑下一组参数, 夏普比率越高越好
+    results_list = []
+
+    def objective(trial):
+        rsi_short = trial.suggest_int('rsi_short', 5, 15, step=2)
+        rsi_long = trial.suggest_int('rsi_long', 20, 40, step=5)
+        ret, sharpe = run_once(data, rsi_short, rsi_long)
+        results_list.append({'rsi_short': rsi_short, 'rsi_long': rsi_long, 'return': ret, 'sharpe': sharpe})
+        return sharpe if sharpe is not None else -float('inf')     # 没有交易时夏普比率是None
+
+    print(f"开始参数优化(TPE, {n_trials}次)...")
+    optuna.logging.set_verbosity(optuna.logging.WARNING)      # 不打印每一次的日志
+    study = optuna.create_study(direction='maximize')
+    study.optimize(objective, n_trials=n_trials)
+
+    best_params = results_list[study.best_trial.number]
+    return best_params, results_list
+
+
+def optimize_parameters(search='vector', n_trials=30, plot=False):
+    # 1. 加载本地AAL数据 (列名在csv里已经是小写的, 不用再改名)
+    df = read_price_csv('./AAL_year_data.csv')
+
+    data = DirectData(dataname=df)
+
+    # 网格搜索跑完全部30组 (默认用numpy算, grid 用Backtrader跑); TPE 只跑 n_trials 次
+    if search == 'tpe' and HAS_OPTUNA:
+        best_params, results_list = tpe_search(data, n_trials)
+    elif search == 'grid':
+        best_params, results_list = grid_search(data)
+    else:
+        if search == 'tpe':
+            print("没有安装optuna, 改用网格搜索")
+        best_params, results_list = vector_grid_search(df)
 
-    # 9. 输出结果
+    # 8. 输出结果
     print("\n=== 最佳参数组合 ===")
     print(f"短期RSI周期: {best_params['rsi_short']}天")
     print(f"长期RSI周期: {best_params['rsi_long']}天")
@@ -105,7 +232,9 @@ def optimize_parameters():
     results_df.to_csv('AAL_optimization_results.csv', index=False)
     print("\n所有参数组合结果已保存到 AAL_optimization_results.csv")
 
-    # 用最佳参数绘制图
+    # 用最佳参数绘制图; 加上 --plot 才画图
+    if not plot:
+        return
     print(f"\n使用最佳参数运行并绘制")
     cerebro = bt.Cerebro()
     cerebro.adddata(data)
@@ -120,4 +249,10 @@ def optimize_parameters():
     cerebro.plot()
 
 if __name__ == '__main__':
-    optimize_parameters()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--search', choices=['vector', 'grid', 'tpe'], default='vector',
+                        help='参数搜索方法: numpy网格 或 Backtrader网格 或 TPE')
+    parser.add_argument('--trials', type=int, default=30, help='TPE 搜索的次数')
+    parser.add_argument('--plot', action='store_true', help='用最佳参数再跑一次并绘制图表')
+    args = parser.parse_args()
+    optimize_parameters(search=args.search, n_trials=args.trials, plot=args.plot)
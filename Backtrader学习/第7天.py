@@ -4,8 +4,11 @@
 '''
 
 
-import backtrader as bt
+import argparse
+import numpy as np
 import pandas as pd
+import backtrader as bt
+from data_loader import read_price_csv, bt_ema, bt_rsi, bt_crossover, DirectData
 
 class RSI_EMA_Strategy(bt.Strategy):
     params = (
@@ -13,52 +16,69 @@ class RSI_EMA_Strategy(bt.Strategy):
         ('ema_slow', 20),
         ('rsi_period', 14),
         ('rsi_buy', 30),
-        ('rsi_sell', 70)
+        ('rsi_sell', 70),
+        ('debug', False)        # True 才打印每根K线的指标
     )
 
+    # 买卖信号先存起来, 回测结束时一次打印, 不用每次都写到终端
+    def log(self, txt):
+        self.logs.append(txt)
+
     def __init__(self):
-        self.ema_fast = bt.indicators.ExponentialMovingAverage(self.data.close, period=self.p.ema_fast)
-        self.ema_slow = bt.indicators.ExponentialMovingAverage(self.data.close, period=self.p.ema_slow)
-        self.rsi = bt.indicators.RelativeStrengthIndex(self.data.close, period=self.p.rsi_period)
-        self.cross = bt. indicators.CrossOver(self.ema_fast, self.ema_slow)
+        # 数据已经预先加载好了, EMA, RSI(有numba时编译过的循环) 和交叉信号一次性算好, 不用Backtrader每根K线再算
+        close = pd.Series(np.asarray(self.data.close.array))
+        ema_fast = bt_ema(close, self.p.ema_fast)
+        ema_slow = bt_ema(close, self.p.ema_slow)
+        self.ema_fast = ema_fast.to_numpy()
+        self.ema_slow = ema_slow.to_numpy()
+        self.rsi = bt_rsi(close, self.p.rsi_period).to_numpy()
+        self.cross = bt_crossover(ema_fast, ema_slow).to_numpy()
+
+        # 和原来的指标一样, 交叉信号要 ema_slow + 1 根K线, RSI 要 rsi_period + 1 根K线才算好, 之前不交易
+        self.warmup = max(self.p.ema_slow + 1, self.p.rsi_period + 1)
 
         # 交易记录
         self.order = None
         self.trade_count = 0
+        self.logs = []
 
     def next(self):
-        if self.order:
+        if self.order or len(self) < self.warmup:
             return
 
+        i = len(self) - 1
+        ema_fast, ema_slow, rsi, cross = self.ema_fast[i], self.ema_slow[i], self.rsi[i], self.cross[i]
+
         # 打印调试信息
-        print(f"日期: {self.data.datetime.date(0)}, 收盘价: {self.data.close[0]: .2f}, "
-              f"EMA快: {self.ema_fast[0]:.2f}, EMA慢: {self.ema_slow[0]:.2f}, "
-              f"RSI: {self.rsi[0]:.2f}, 交叉: {self.cross[0]}")
+        if self.p.debug:
+            print(f"日期: {self.data.datetime.date(0)}, 收盘价: {self.data.close[0]: .2f}, "
+                  f"EMA快: {ema_fast:.2f}, EMA慢: {ema_slow:.2f}, "
+                  f"RSI: {rsi:.2f}, 交叉: {cross}")
 
         if not self.position:
             # EMA金叉 和RSI 超卖, 买入
-            if self.cross[0] > 0 or self.rsi[0] < self.p.rsi_buy:
+            if cross > 0 or rsi < self.p.rsi_buy:
                 self.order = self.buy()
-                print(f"买入信号: {self.data.close[0]:.2f}")
+                self.log(f"{self.data.datetime.date(0)} 买入信号: {self.data.close[0]:.2f}")
                 self.trade_count += 1       # 每次都会加入到trade_count
         else:
             # 卖出条件: EMA死叉 和RSI超买, 卖出
-            if self.cross[0] < 0 or self.rsi[0] > self.p.rsi_buy:
+            if cross < 0 or rsi > self.p.rsi_buy:
                 self.order = self.sell()
-                print(f"卖出信号: {self.data.close[0]:.2f}")
+                self.log(f"{self.data.datetime.date(0)} 卖出信号: {self.data.close[0]:.2f}")
                 self.trade_count += 1
 
     def stop(self):
+        print('\n'.join(self.logs))
         print(f"\n策略结果, 总交易次数: {self.trade_count}")
 
-def run_strategy():
+def run_strategy(plot=False):
     # 加载数据
     try:
         file_path = './AAPL_year_data.csv'
-        df = pd.read_csv(file_path, parse_dates=['date'])
-        df.set_index('date', inplace=True)
+        df = read_price_csv(file_path)
 
-        data = bt.feeds.PandasData(dataname=df)
+        data = DirectData(dataname=df)
     except Exception as e:
         print(f" 数据加载失败: {e}")
         return
@@ -95,10 +115,14 @@ def run_strategy():
     print(f"最大回测: {drawdown.get('max', {}).get('min', 0):.2f}")
     print(f"总交易次数: {trades.get('total', {}).get('closed', 0)}")
 
-    # 绘制结果;
-    print(f"\n正在绘制结果图表......")
-    cerebro.plot()
+    # 绘制结果; 加上 --plot 才画图
+    if plot:
+        print(f"\n正在绘制结果图表......")
+        cerebro.plot()
 
 if __name__ == "__main__":
-    run_strategy()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_strategy(plot=args.plot)
 
@@ -3,9 +3,36 @@
 	添加风险管理模块，如止损和止盈机制。
 '''
 
-import pandas as pd
+import argparse
+import numpy as np
 import backtrader as bt
+from data_loader import load_df, DirectData
 
+# 交易记录的每一列; type: 1=买入, -1=卖出
+TRADE_DTYPE = [('date', 'datetime64[D]'), ('type', 'i1'), ('price', 'f8'), ('size', 'f8'),
+               ('value', 'f8'), ('commission', 'f8'), ('pnl', 'f8')]
+
+
+# 策略运行时的状态单独放在有 __slots__ 的对象里, 没有 __dict__, 每组参数占的内存更少
+# (Backtrader 的策略类有元类, 策略本身不能用 __slots__)
+class TradingState:
+    __slots__ = ('order', 'stop_order', 'take_profit_order', 'trailing_stop_order', 'entry_price',
+                 'trade_count', 'win_count', 'trade_history', 'trade_n')
+
+    def __init__(self):
+        # 初始化订单和状态
+        self.order = None
+        self.stop_order = None
+        self.take_profit_order = None
+        self.trailing_stop_order = None
+        self.entry_price = 0
+
+        # 统计交易次数
+        self.trade_count = 0
+        self.win_count = 0
+        # 交易记录预先分配好的结构化数组, 不用每次成交都建一个dict; 不够用时再扩大一倍
+        self.trade_history = np.empty(256, dtype=TRADE_DTYPE)
+        self.trade_n = 0
 
 
 class MACD_RSI_Strategy(bt.Strategy):
@@ -44,16 +71,8 @@ class MACD_RSI_Strategy(bt.Strategy):
 
         self.rsi = bt.indicators.RSI(self.data.close, period=self.p.rsi_period)
 
-        # 初始化订单和状态
-        self.order = None
-        self.stop_order = None
-        self.take_profit_order = None
-        self.entry_price = 0
-
-        # 统计交易次数
-        self.trade_count = 0
-        self.win_count = 0
-        self.trade_history = []
+        # 订单, 入场价, 交易统计都放在 self.st 里
+        self.st = TradingState()
 
     # 当订单状态改变时调用
     def notify_order(self, order):
@@ -64,21 +83,21 @@ class MACD_RSI_Strategy(bt.Strategy):
             if order.isbuy():
                 # 买入成功
                 self.log(f"买入执行, 价格: {order.executed.price:.2f}")
-                self.entry_price = order.executed.price
+                self.st.entry_price = order.executed.price
 
                 # 设置止损价和止盈价
-                stop_price = self.entry_price * (1-self.p.stop_loss)
-                tp_price = self.entry_price * (1+self.p.take_profit)
+                stop_price = self.st.entry_price * (1-self.p.stop_loss)
+                tp_price = self.st.entry_price * (1+self.p.take_profit)
 
                 # 生成止损订单
-                self.stop_order = self.sell(
+                self.st.stop_order = self.sell(
                     exectype=bt.Order.Stop,
                     price=stop_price,
                     size=order.executed.size,
                     transmit=False)
 
                 # 生成止盈订单
-                self.take_profit_order = self.sell(
+                self.st.take_profit_order = self.sell(
                     exectype=bt.Order.Limit,
                     price=tp_price,
                     size=order.executed.size,
@@ -86,7 +105,7 @@ class MACD_RSI_Strategy(bt.Strategy):
 
                 # 用跟踪止损
                 if self.p.trailing_stop:
-                    self.trailing_stop_order = self.sell(
+                    self.st.trailing_stop_order = self.sell(
                         exectype=bt.Order.StopTrail,
                         trailpercent=self.p.trail_percent,
                         size=order.executed.size)
@@ -94,49 +113,52 @@ class MACD_RSI_Strategy(bt.Strategy):
             elif order.issell():
                 #卖出
                 self.log(f"执行卖出, 价格: {order.executed.price:.2f}")
-                profit_pct = (order.executed.price / self.entry_price - 1)* 100
+                profit_pct = (order.executed.price / self.st.entry_price - 1)* 100
                 if profit_pct > 0:
-                    self.win_count += 1
+                    self.st.win_count += 1
 
                 # 取消未触发的止盈和止损
-                if self.stop_order:
-                    self.cancel(self.stop_order)
-                if self.take_profit_order:
-                    self.cancel(self.take_profit_order)
-                if hasattr(self, 'trailing_stop_order'):
-                    self.cancel(self.trailing_stop_order)
+                if self.st.stop_order:
+                    self.cancel(self.st.stop_order)
+                if self.st.take_profit_order:
+                    self.cancel(self.st.take_profit_order)
+                if self.st.trailing_stop_order:
+                    self.cancel(self.st.trailing_stop_order)
 
             # 记录每笔交易
-            self.trade_history.append({
-                'date': self.data.datetime.date(0),
-                'type': 'buy' if order.isbuy() else 'sell',
-                'price': order.executed.price,
-                'size': order.executed.size,
-                'value': order.executed.value,
-                'commission': order.executed.comm,
-                'pnl': order.executed.pnl
-            })
+            if self.st.trade_n == len(self.st.trade_history):
+                self.st.trade_history = np.resize(self.st.trade_history, 2 * self.st.trade_n)
+            self.st.trade_history[self.st.trade_n] = (
+                self.data.current_date(),
+                1 if order.isbuy() else -1,
+                order.executed.price,
+                order.executed.size,
+                order.executed.value,
+                order.executed.comm,
+                order.executed.pnl
+            )
+            self.st.trade_n += 1
 
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
             self.log('订单取消/保证金不足/被拒绝')
-        self.order = None
+        self.st.order = None
 
     def next(self):
-        if self.order:
+        if self.st.order:
             return
 
         if not self.position:
             if self.macd_cross[0] > 0 and self.rsi[0] < self.p.rsi_buy:
                 size = self.broker.getcash() * self.p.trade_size / self.data.close[0]
-                self.order = self.buy(size=size)
-                self.trade_count += 1
+                self.st.order = self.buy(size=size)
+                self.st.trade_count += 1
         else:
             # 持有仓位时考虑动态更新止损价
             current_price = self.data.close[0]
-            if current_price > self.entry_price * (1+self.p.stop_loss * self.p.risk_reward_ratio):
+            if current_price > self.st.entry_price * (1+self.p.stop_loss * self.p.risk_reward_ratio):
                 new_stop = current_price * (1-self.p.stop_loss)
-                self.cancel(self.stop_order)
-                self.stop_order = self.sell(
+                self.cancel(self.st.stop_order)
+                self.st.stop_order = self.sell(
                     exectype=bt.Order.Stop,
                     price=new_stop,
                     size=self.position.size,
@@ -145,23 +167,35 @@ class MACD_RSI_Strategy(bt.Strategy):
     # 回测结果后运行
     def stop(self):
         self.log("期末资金: %.2f" % self.broker.getvalue(), doprint=True)
-        self.log('总交易次数: %d' % self.trade_count, doprint=True)
-        if self.trade_count > 0:
-            self.log("胜率: %.2f%%" % (self.win_count / self.trade_count * 100), doprint=True)
+        self.log('总交易次数: %d' % self.st.trade_count, doprint=True)
+        if self.st.trade_count > 0:
+            self.log("胜率: %.2f%%" % (self.st.win_count / self.st.trade_count * 100), doprint=True)
+
+        # 优化时只需要这几个数, 交易明细用不到了, 删掉省内存
+        self.summary = {
+            'final_value': self.broker.getvalue(),
+            'trade_count': self.st.trade_count,
+            'win_count': self.st.win_count
+        }
+        del self.st.trade_history
+
+
+# optreturn=True 时只有参数和分析器会传回来, 用分析器把策略的summary带回来
+class Summary(bt.Analyzer):
+    def stop(self):
+        self.rets.update(self.strategy.summary)
 
 # 先加载数据
 def load_data():
     file_path = './AI_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df.set_index('date', inplace=True)
+    df = load_df(file_path)     # 同一个进程里只读一次csv
 
-    data = bt.feeds.PandasData(dataname=df)
+    data = DirectData(dataname=df)
     return data
 
 # 回测主函数
-def run_optimization():
-    cerebro = bt.Cerebro(optreturn=False)
+def run_optimization(plot=False):
+    cerebro = bt.Cerebro(optreturn=True, stdstats=False)     # 不要观察器, 只传回参数和分析器
 
     data = load_data()      # 调用load_data
     cerebro.adddata(data)
@@ -175,27 +209,49 @@ def run_optimization():
         rsi_buy = [25, 30, 35],
         stop_loss = [0.03, 0.05],
         take_profit = [0.08, 0.1],
-        trailing_stop = [False],
-        printlog = [True]
+        trailing_stop = [False]
     )
+    cerebro.addanalyzer(Summary, _name='summary')
 
     cerebro.broker.set_cash(100000)
     cerebro.broker.setcommission(commission=0.001)
 
+    # maxcpus 默认是None, 已经用所有CPU的进程池一起跑了.
+    # 期末资金在每个策略stop的时候就记下来了, 所以不开进程池(maxcpus=1)也不会都变成最后一组的资金
     opt_runs = cerebro.run()
 
     # 输出每组结果
     for run in opt_runs:
         strat = run[0]
         print('最终终极: %.2f, 参数: rsi_buy=%d, stop_loss=%.2f, take_profit=%.2f' % (
-            strat.broker.getvalue(),
+            strat.analyzers.summary.get_analysis()['final_value'],
             strat.params.rsi_buy,
             strat.params.stop_loss,
             strat.params.take_profit
         ))
 
+    # 加上 --plot 才画图
+    if not plot:
+        return
+
+    # 传回来的只有参数和分析器, 不能直接画图; 用最好的一组参数再跑一次来画图
+    best = max(opt_runs, key=lambda run: run[0].analyzers.summary.get_analysis()['final_value'])[0]
+    cerebro = bt.Cerebro()
+    cerebro.adddata(data)
+    cerebro.addstrategy(
+        MACD_RSI_Strategy,
+        rsi_buy=best.params.rsi_buy,
+        stop_loss=best.params.stop_loss,
+        take_profit=best.params.take_profit
+    )
+    cerebro.broker.set_cash(100000)
+    cerebro.broker.setcommission(commission=0.001)
+    cerebro.run()
     cerebro.plot(style='candlestick')
 
 if __name__ == "__main__":
-    run_optimization()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='用最佳参数再跑一次并绘制图表')
+    args = parser.parse_args()
+    run_optimization(plot=args.plot)
 
@@ -3,38 +3,53 @@
 	练习：实现止损和止盈策略，并重新回测。
 '''
 
+import argparse
+import sys
+import numpy as np
 import backtrader as bt
-import pandas as pd
-from trio import sleep
+# numba 可以把循环编译成机器码. 没有安装的话 njit 什么都不做, 直接用Python循环
+from data_loader import load_data, load_df, bt_sma, njit
 
 
-def load_data():
-    file_path = './AI_year_data.csv'
-    df = pd.read_csv(file_path)
-    df['date'] = pd.to_datetime(df['date'])
-    df['openinterest'] = 0
-    df.set_index('date', inplace=True)
-    # print(df.head())
-    data = bt.feeds.PandasData(dataname=df)
-    return data
+# 交易类型, 策略的日志和 simulate 都用
+BUY, TAKE_PROFIT, STOP_LOSS = 1, 2, 3
+
+
+def format_trades(dates, kinds, prices):
+    # 把所有交易记录一次拼成字符串, 不用每笔交易print一次
+    lines = []
+    for d, kind, price in zip(dates, kinds, prices):
+        if kind == BUY:
+            lines.append(f"买入时间: {d}, 买入价格: {price:.2f}")
+        elif kind == TAKE_PROFIT:
+            lines.append(f"止盈卖出时间: {d}, 当前价格: {price:.2f}")
+        else:
+            lines.append(f"止损卖出时间: {d},  当前价格: {price:.2f}")
+    return ''.join(line + '\n' for line in lines)
+
 
 class Stop_loss_take_profit(bt.Strategy):
     params = (
         ('ma_short', 5),
         ('ma_long', 30),
         ('stop_loss', 0.05),    # 止损5%
-        ('take_profit', 0.1)    # 止盈10%
+        ('take_profit', 0.1),   # 止盈10%
+        ('verbose', True),      # 回测结束后是否打印每笔交易
               )
 
     ''' 只有计算止盈和止损'''
     def __init__(self):
         self.order = None
         self.buy_price = None
+        self._log = []      # (日期, 交易类型, 价格), 回测结束时一次打印
 
         self.ma_short = bt.indicators.MovingAverageSimple(self.data.close, period=self.params.ma_short)
         self.ma_long = bt.indicators.MovingAverageSimple(self.data.close, period=self.params.ma_long)
 
     def next(self):
+        # 长均线还没算好时不做任何判断; 指标的minperiod本来就会让Backtrader先调用prenext, 这里再明确保护一次
+        if len(self) < self.params.ma_long:
+            return
         if self.order:
             return
 
@@ -43,7 +58,7 @@ class Stop_loss_take_profit(bt.Strategy):
             if self.ma_short[0] > self.ma_long[0]:
                 self.order = self.buy()
                 self.buy_price = self.data.close[0]
-                print(f"买入时间: {self.datas[0].datetime.date(0)}, 买入价格: {self.buy_price:.2f}")
+                self._log.append((self.datas[0].current_date(), BUY, self.buy_price))
         else:
             current_price = self.data.close[0]
             # 计算止损和止盈
@@ -52,20 +67,90 @@ class Stop_loss_take_profit(bt.Strategy):
 
             if current_price >= take_profit_price:
                 self.order = self.sell()
-                print(f"止盈卖出时间: {self.datas[0].datetime.date(0)}, 当前价格: {current_price:.2f}")
+                self._log.append((self.datas[0].current_date(), TAKE_PROFIT, current_price))
             elif current_price <= stop_lost_price:
                 self.order = self.sell()
-                print(f"止损卖出时间: {self.datas[0].datetime.date(0)},  当前价格: {current_price:.2f}")
+                self._log.append((self.datas[0].current_date(), STOP_LOSS, current_price))
 
     def notify_order(self, order):
         if order.status in [order.Completed, order.Canceled, order.Rejected]:
             self.order = None
 
-def run_testting():
+    def stop(self):
+        if self.params.verbose and self._log:
+            sys.stdout.write(format_trades(*zip(*self._log)))
+
+
+@njit(cache=True)
+def simulate(open_price, close, ma_short, ma_long, stop_loss, take_profit, cash, commission, stake):
+    ''' 不用Backtrader, 一次循环跑完 Stop_loss_take_profit 策略.
+    规则和Backtrader一样: 信号出现后下一根K线开盘成交, 每次买卖stake股, 手续费按成交额收,
+    最后一根K线下的单不会成交; 止盈止损按下单那天的收盘价算. 10股几百块, 资金一直够.
+    返回 (期末资金, 下单的K线位置, 交易类型) '''
+    n = close.shape[0]
+    bars = np.empty(n, dtype=np.int64)
+    kinds = np.empty(n, dtype=np.int8)
+    k = 0
+    position = 0
+    pending = 0         # 1=有买单等成交, -1=有卖单等成交
+    buy_price = 0.0
+    for i in range(n):
+        # 上一根K线下的单在今天开盘成交
+        if pending == 1:
+            cash -= stake * open_price[i]
+            cash -= stake * open_price[i] * commission
+            position = stake
+        elif pending == -1:
+            cash += position * open_price[i]
+            cash -= position * open_price[i] * commission
+            position = 0
+        pending = 0
+
+        if position == 0:
+            if ma_short[i] > ma_long[i]:        # 均线还没算好时是nan, 比较结果是False
+                pending = 1
+                buy_price = close[i]
+                bars[k] = i
+                kinds[k] = BUY
+                k += 1
+        elif close[i] >= buy_price * (1 + take_profit):
+            pending = -1
+            bars[k] = i
+            kinds[k] = TAKE_PROFIT
+            k += 1
+        elif close[i] <= buy_price * (1 - stop_loss):
+            pending = -1
+            bars[k] = i
+            kinds[k] = STOP_LOSS
+            k += 1
+    return cash + position * close[n - 1], bars[:k], kinds[:k]
+
+
+def run_vectorized(csv_path, cash=10000, commission=0.01, stake=10):
+    # 均线用pandas一次算好, 策略用 simulate 跑, 打印的内容和Backtrader一样
+    df = load_df(csv_path)
+    p = Stop_loss_take_profit.params
+    close = df['close'].to_numpy()
+    final_value, bars, kinds = simulate(df['open'].to_numpy(), close,
+                                        bt_sma(df['close'], p.ma_short).to_numpy(), bt_sma(df['close'], p.ma_long).to_numpy(),
+                                        p.stop_loss, p.take_profit, float(cash), commission, stake)
+
+    dates = df.index.values.astype('datetime64[D]')
+    print(f"初始资金: {cash:.2f}")
+    sys.stdout.write(format_trades(dates[bars], kinds, close[bars]))
+    print(f"最终终极: {final_value:.2f}")
+
+
+def run_testting(plot=False):
+    # 不画图的话用numpy直接算出结果, 和Backtrader跑出来的一样, 只是快很多
+    if not plot:
+        run_vectorized('./AI_year_data.csv')
+        return
+
     cerebro = bt.Cerebro()
     cerebro.addstrategy(Stop_loss_take_profit)
 
-    data = load_data()
+    data = load_data('./AI_year_data.csv')
     cerebro.adddata(data)
     cerebro.broker.setcash(10000)
     cerebro.broker.setcommission(commission=0.01)
@@ -74,9 +159,12 @@ def run_testting():
     print(f"初始资金: {cerebro.broker.getvalue():.2f}")
     cerebro.run()
     print(f"最终终极: {cerebro.broker.getvalue():.2f}")
-    cerebro.plot()
+    cerebro.plot()      # 加上 --plot 才会走到这里
 
 
 if __name__ == "__main__":
-    run_testting()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot', action='store_true', help='回测完成后绘制图表')
+    args = parser.parse_args()
+    run_testting(plot=args.plot)
 
@@ -5,12 +5,11 @@ from scipy.optimize import minimize
 import glob, os
 import matplotlib.pyplot as plt
 from datetime import datetime
-import matplotlib as mpl
 
 # 中文显示
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False
-mpl.rcParams['font.family'] = 'sans-serif'
+plt.rcParams['font.family'] = 'sans-serif'
 
 class QuantitativePortfolioAnalyzer:
     """Day 8 综合实战项目：债券+期权组合分析"""
@@ -68,62 +67,53 @@ class QuantitativePortfolioAnalyzer:
     def analyze_bonds(self):
         """债券收益率分析 + QuantLib定价"""
         latest_treasury = self.treasury.iloc[-1]
-
-        self.bond_characteristics = []
-
-        for idx, bond in self.bonds.iterrows():
-            security_type = bond.get('Security Type','Unknown')
-            security_term = bond.get('Security Term','1-Year')
-
-            # 计算债券收益率和久期
-            if '10-Year' in str(security_term):
-                ytm = latest_treasury['DGS10']/100
-                duration = 10
-            elif '5-Year' in str(security_term):
-                ytm = latest_treasury['DGS5']/100
-                duration = 5
-            else:
-                ytm = latest_treasury['DGS2']/100
-                duration = 2
-
-            # QuantLib定价
+        security_type = self.bonds.get('Security Type', pd.Series('Unknown', index=self.bonds.index))
+        security_term = self.bonds.get('Security Term', pd.Series('1-Year', index=self.bonds.index))
+
+        # 计算债券收益率和久期: 整列一起按期限判断, 不用iterrows一行一行看
+        term = security_term.astype(str)
+        is_10y = term.str.contains('10-Year', regex=False).to_numpy()
+        is_5y = term.str.contains('5-Year', regex=False).to_numpy()
+        duration = np.select([is_10y, is_5y], [10, 5], default=2)
+        ytm = np.select([is_10y, is_5y], [latest_treasury['DGS10'], latest_treasury['DGS5']],
+                        default=latest_treasury['DGS2']) / 100
+
+        # QuantLib定价: 只有几种期限, 每种期限只定价一次, 再按期限填回每只债券
+        today = ql.Date.todaysDate()
+        ql.Settings.instance().evaluationDate = today
+        prices = {}
+        for d, y in set(zip(duration, ytm)):
             try:
-                today = ql.Date.todaysDate()
-                ql.Settings.instance().evaluationDate = today
-                schedule = ql.Schedule(today, today + ql.Period(duration, ql.Years),
+                schedule = ql.Schedule(today, today + ql.Period(int(d), ql.Years),
                                        ql.Period(ql.Annual), ql.NullCalendar(),
                                        ql.Unadjusted, ql.Unadjusted,
                                        ql.DateGeneration.Backward, False)
-                bond_ql = ql.FixedRateBond(1, 100, schedule, [ytm], ql.ActualActual())
-                bond_price = bond_ql.cleanPrice()
+                bond_ql = ql.FixedRateBond(1, 100, schedule, [float(y)], ql.ActualActual())
+                prices[d, y] = bond_ql.cleanPrice()
             except:
-                bond_price = 100
+                prices[d, y] = 100
 
-            self.bond_characteristics.append({
-                'type': security_type,
-                'term': security_term,
-                'yield': ytm,
-                'duration': duration,
-                'price': bond_price
-            })
+        self.bond_characteristics = pd.DataFrame({
+            'type': security_type.to_numpy(),
+            'term': security_term.to_numpy(),
+            'yield': ytm,
+            'duration': duration,
+            'price': [prices[key] for key in zip(duration, ytm)]
+        })
 
-        self.avg_bond_yield = np.mean([b['yield'] for b in self.bond_characteristics])*100
+        self.avg_bond_yield = self.bond_characteristics['yield'].mean()*100
         print(f"📈 平均债券收益率: {self.avg_bond_yield:.2f}%")
         return True
 
     def analyze_options(self):
         """期权分析 + QuantLib定价"""
-        vols = []
-        strikes = []
-        for idx, row in self.options.iterrows():
-            iv = pd.to_numeric(row.get('impliedVolatility', np.nan), errors='coerce')
-            strike = pd.to_numeric(row.get('strike', np.nan), errors='coerce')
-            if not pd.isna(iv) and iv>0:
-                vols.append(iv)
-            if not pd.isna(strike):
-                strikes.append(strike)
-        self.avg_option_vol = np.median(vols)*100 if vols else 50
-        self.underlying_price = np.mean(strikes)*1.05 if strikes else 200
+        # 整列一起转成数字, 转不了的变成nan, 不用iterrows一行一行转
+        iv = pd.to_numeric(self.options.get('impliedVolatility', pd.Series(dtype=float)), errors='coerce').to_numpy(dtype=float)
+        strike = pd.to_numeric(self.options.get('strike', pd.Series(dtype=float)), errors='coerce').to_numpy(dtype=float)
+        vols = iv[iv > 0]       # nan > 0 是False, 也一起去掉了
+        strikes = strike[~np.isnan(strike)]
+        self.avg_option_vol = np.median(vols)*100 if vols.size else 50
+        self.underlying_price = np.mean(strikes)*1.05 if strikes.size else 200
         print(f"📉 平均期权隐含波动率: {self.avg_option_vol:.2f}%")
         return True
 
@@ -161,17 +151,20 @@ class QuantitativePortfolioAnalyzer:
         bond_returns = np.random.normal(bond_daily, 0.001, 10000)
         option_returns = np.random.normal(option_daily, 0.02, 10000)
 
+        # 组合的均值和方差只由两个收益序列的均值和协方差决定, 先算好, 目标函数里不用每次再生成10000个组合收益
+        mu = np.array([bond_returns.mean(), option_returns.mean()])
+        cov = np.cov(bond_returns, option_returns, bias=True)     # bias=True 和 np.std 一样除以 N
+
         def objective(w):
-            r = w[0]*bond_returns + w[1]*option_returns
-            return -np.mean(r)/np.std(r)  # 最大化夏普比率
+            return -(w @ mu) / np.sqrt(w @ cov @ w)  # 最大化夏普比率
 
         cons = ({'type':'eq','fun': lambda w: np.sum(w)-1})
         bounds = [(0,1),(0,1)]
         res = minimize(objective,[0.5,0.5],bounds=bounds,constraints=cons)
         self.optimal_weights = res.x
 
-        port_return = np.mean(self.optimal_weights[0]*bond_returns + self.optimal_weights[1]*option_returns)*252*100
-        port_risk = np.std(self.optimal_weights[0]*bond_returns + self.optimal_weights[1]*option_returns)*np.sqrt(252)*100
+        port_return = self.optimal_weights @ mu * 252 * 100
+        port_risk = np.sqrt(self.optimal_weights @ cov @ self.optimal_weights) * np.sqrt(252) * 100
         print(f"🎯 最优组合: 债券 {self.optimal_weights[0]:.2f}, 期权 {self.optimal_weights[1]:.2f}")
         print(f"   组合年化收益 {port_return:.2f}%, 年化风险 {port_risk:.2f}%")
         return True
@@ -5,6 +5,7 @@ import pandas_datareader.data as web
 import pandas as pd
 from datetime import datetime, timedelta
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # 设置时间
 start = datetime.now() - timedelta(days=365*10) # 计算10年
@@ -14,12 +15,14 @@ end = datetime.now()
 ticker_input = input(f"请输入股票代码: ")
 tickers = [t.strip().upper() for t in ticker_input.split(",") if t.strip()]
 
-for ticker in tickers:
+
+# 每只股票的下载和保存; 主要时间都在等网络, 所以下面用线程池同时下载几只
+def fetch(ticker):
     try:
         filename = f"./{ticker}_stock.xlsx"
         if os.path.exists(filename):
             print(f"{filename}已存在, 跳过下载")
-            continue
+            return
         print(f"正在下载{ticker}数据.....")
 
         # 如果yahoo获取数据失败, 就改用stooq获取数据.
@@ -29,9 +32,12 @@ for ticker in tickers:
             print(f"Yahoo 失败, 尝试Stooq...")
             df = web.DataReader(f"{ticker}.US", "stooq", start, end)
 
+        # 还是保存成xlsx: 第7天按 *_stock.xlsx 找股票文件, 第一次读取时会自己再存一份parquet缓存
         df.to_excel(filename)
         print(f"{ticker}已保存到{filename}")
     except Exception as e:
         print(f"获取{ticker}失败: {e}")
 
 
+with ThreadPoolExecutor(max_workers=8) as ex:
+    list(ex.map(fetch, tickers))
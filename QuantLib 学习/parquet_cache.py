@@ -0,0 +1,24 @@
+'''
+公用的excel缓存函数.
+第6天, 第7天, 第8天 都要反复读取 *.xlsx, 第一次读取后保存成parquet, 之后直接读parquet, 比openpyxl解析excel快很多.
+缓存文件统一命名为 原文件名 + suffix (默认 AAPL_stock.xlsx -> AAPL_stock.xlsx.parquet);
+同一个文件要缓存不同内容时, 用不同的 suffix 区分.
+'''
+
+import os
+import pandas as pd
+
+
+def read_cached(path, read, suffix='.parquet'):
+    # read(path) 负责真正读取excel并返回DataFrame; parquet 存在并且比原文件新, 就直接读取parquet
+    parquet_path = path + suffix
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        return pd.read_parquet(parquet_path)
+    df = read(path)
+
+    # 保存成parquet, 没有安装pyarrow的话就不保存
+    try:
+        df.to_parquet(parquet_path, engine='pyarrow')
+    except ImportError:
+        pass
+    return df
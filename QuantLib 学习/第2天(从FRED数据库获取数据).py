@@ -11,11 +11,17 @@ Day 2：获取美国国债数据
 输出：可用国债数据的CSV或DataFrame。
 '''
 
+import argparse
+import os
 import pandas as pd
 from pandas_datareader import data as pdr
 import datetime
 import QuantLib as ql
 
+parser = argparse.ArgumentParser()
+parser.add_argument('--export-xlsx', action='store_true', help='没有新数据也重新保存 US_Treasury_Yields.xlsx')
+args = parser.parse_args()
+
 # 设置时间范围
 start = datetime.datetime(2020,1,1)       # 数据开始时间：2020年1月1日
 end = datetime.datetime.today()           # 数据结束时间：今天
@@ -29,19 +35,35 @@ end = datetime.datetime.today()           # 数据结束时间：今天
 
 fred_codes = ['DGS1', 'DGS2', 'DGS5', 'DGS10', 'DGS30']
 
-# 用pandas_datareader获取数据
-df = pdr.DataReader(fred_codes, 'fred', start, end)     #从 FRED 数据库 获取指定时间范围内的多列数据。
+def fetch_yields(start, end):
+    # 用pandas_datareader获取数据
+    df = pdr.DataReader(fred_codes, 'fred', start, end)     #从 FRED 数据库 获取指定时间范围内的多列数据。
+
+    # 删除缺失值
+    df.dropna(inplace=True)     # 有些日期（比如节假日）没有数据，dropna 删除这些行。
 
-# 删除缺失值
-df.dropna(inplace=True)     # 有些日期（比如节假日）没有数据，dropna 删除这些行。
+    # 重设索引
+    df.reset_index(inplace=True)        # reset_index 把日期索引变成普通列。
+    df.rename(columns={'index': 'Date'}, inplace=True)      # 把 index 改名为 Date。
+    return df
 
-# 重设索引
-df.reset_index(inplace=True)        # reset_index 把日期索引变成普通列。
-df.rename(columns={'index': 'Date'}, inplace=True)      # 把 index 改名为 Date。
+# 下载过的数据保存成parquet (文件名里有开始日期), 之后只下载最后一天以后的新数据
+cache_path = f'./US_Treasury_Yields_{start:%Y%m%d}.parquet'
+if os.path.exists(cache_path):
+    cached = pd.read_parquet(cache_path)
+    next_day = cached['DATE'].max() + pd.Timedelta(days=1)
+    new_rows = fetch_yields(next_day, end) if next_day <= end else cached.iloc[:0]
+    df = pd.concat([cached, new_rows], ignore_index=True).drop_duplicates('DATE', keep='last')
+else:
+    df = new_rows = fetch_yields(start, end)
 
 print(df.head())
 
-df.to_excel('./US_Treasury_Yields.xlsx', index=False)
+# 有新数据才重新保存; 后面几天的脚本读的是xlsx, 所以xlsx也一起更新
+if len(new_rows):
+    df.to_parquet(cache_path, engine='pyarrow', compression='zstd')
+if len(new_rows) or args.export_xlsx:
+    df.to_excel('./US_Treasury_Yields.xlsx', index=False)
 
 # 整理为QuantLib 可用的表格
 # 选择10年期的收益率列
@@ -66,18 +88,15 @@ print(f'最新 10 年期零息利率: {latest_rates:.4%}')
 
 # 绘制图
 import matplotlib.pyplot as plt
-plt.figure(figsize=(10,6))
-plt.plot(df['DATE'], df['DGS1'], label='1y')
-plt.plot(df['DATE'], df['DGS2'], label='2y')
-plt.plot(df['DATE'], df['DGS5'], label='5y')
-plt.plot(df['DATE'], df['DGS10'], label='10y')
-plt.plot(df['DATE'], df['DGS30'], label='30y')
-
-plt.title('US Treasury Yields (FRED)')
-plt.xlabel('Date')
-plt.ylabel('Yield (%)')
-plt.legend()
-plt.grid(True)
+# 五条收益率曲线一次画完: 每列一条线, 图例直接用改过的列名
+labels = {'DGS1': '1y', 'DGS2': '2y', 'DGS5': '5y', 'DGS10': '10y', 'DGS30': '30y'}
+ax = df.set_index('DATE')[fred_codes].rename(columns=labels).plot(figsize=(10,6))
+
+ax.set_title('US Treasury Yields (FRED)')
+ax.set_xlabel('Date')
+ax.set_ylabel('Yield (%)')
+ax.legend()
+ax.grid(True)
 plt.show()
 
 
@@ -93,6 +112,7 @@ plt.show()
 
 2. 保存数据
 -将整理后的国债数据表保存为 US_Treasury_Yields.xlsx。
+-同时保存一份parquet, 下次运行只下载最后一天以后的新数据。
 👉 用处：以后可以直接用 Excel 文件里的数据，不用每次都联网获取。
 
 3. 转换为 QuantLib 可用格式
@@ -13,9 +13,9 @@ Day 3：债券定价与现金流分析
 '''
 
 import QuantLib as ql
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime
 
 # -------------------------
 # 1. 读取数据
@@ -36,17 +36,19 @@ bond_info = df_sec[df_sec['CUSIP'] == '91282CNX5'].iloc[0]
 # -----------------------
 # 日期处理
 # ----------------------
-# 将字符串日期 (如 8/30/2030) 转为QuantLib.Date
-def to_ql_date(date_str):
-    dt = datetime.strptime(date_str, "%m/%d/%Y")
-    return ql.Date(dt.day, dt.month, dt.year)
+# 字符串日期 (如 8/30/2030) 一次性用pandas按固定格式转好, 不用一个个strptime
+bond_dates = pd.to_datetime(bond_info[['Issue Date', 'Maturity Date']], format="%m/%d/%Y")
+
+# 将pandas日期转为QuantLib.Date
+def to_ql_date(ts):
+    return ql.Date(ts.day, ts.month, ts.year)
 
 # QuantLib 格式日期
-issue_date = to_ql_date(bond_info['Issue Date'])
-maturity_date = to_ql_date(bond_info['Maturity Date'])
+issue_date = to_ql_date(bond_dates['Issue Date'])
+maturity_date = to_ql_date(bond_dates['Maturity Date'])
 
 # Python datetime 用于绘制图
-maturity_dt_py = datetime.strptime(bond_info['Maturity Date'], "%m/%d/%Y")
+maturity_dt_py = bond_dates['Maturity Date'].to_pydatetime()
 
 # ---------------------------
 # 债卷基本参数
@@ -101,11 +103,12 @@ print(f"固定利率债卷净现值 (NPV) : {npv: .4f}")
 # 4. 绘制现金流图
 # --------------------------
 # 获取现金流金额
-cf_amounts = [cf.amount() for cf in fixed_bond.cashflows()]
+cashflows = fixed_bond.cashflows()
+cf_amounts = np.fromiter((cf.amount() for cf in cashflows), dtype=float, count=len(cashflows))
 
-# 将QuantLib.Date 转换Python datetime, 用于绘图
-cf_dates_py = [datetime(cf.date().year(), cf.date().month(), cf.date().dayOfMonth())
-               for cf in fixed_bond.cashflows()]
+# 将QuantLib.Date 转换成numpy日期, 用于绘图: QuantLib的日期序号和Excel一样, 从1899-12-30开始数天数
+cf_serials = np.fromiter((cf.date().serialNumber() for cf in cashflows), dtype=np.int64, count=len(cashflows))
+cf_dates_py = np.datetime64('1899-12-30') + cf_serials.astype('timedelta64[D]')
 
 # 设置中文显示
 import matplotlib
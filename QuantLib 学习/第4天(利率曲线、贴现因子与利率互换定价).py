@@ -9,6 +9,7 @@ Day 4：利率曲线与贴现因子
 """
 
 import QuantLib as ql
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
@@ -45,16 +46,13 @@ zero_curve = ql.ZeroCurve(dates, rates, day_count, calendar, ql.Linear())   #零
 yield_curve = ql.YieldTermStructureHandle(zero_curve)   # 封装为Handle , 用于折现或Swap
 
 # =======================计算贴现因子=============================
-maturities = [1, 2, 5, 10, 30]  # 年期
-discount_factors = []
-
-for m in maturities:
-    d = today + ql.Period(m, ql.Years)  # 到期日
-    df = yield_curve.discount(d)    # 贴现因子 df = e^(-r*t)
-    discount_factors.append((m, df))
+maturities = np.array(list(rates_dict.keys()))  # 年期, 和构建曲线的期限一样
+# 到期日直接用上面构建曲线时的dates, 不用每个期限再建一次 ql.Period 和 ql.Date
+# 不用 discount(时间) 的写法: 曲线的参考日是第一个到期日, 按年数算的时间和按日期算的不一样
+discount_factors = np.fromiter((yield_curve.discount(d) for d in dates), dtype=float, count=len(dates))  # 贴现因子 df = e^(-r*t)
 
 print("\n贴现因子:")
-for m, df in discount_factors:
+for m, df in zip(maturities, discount_factors):
     print(f"{m}年期: {df: .6f}")
 
 # ==========================计算远期利率===================
@@ -81,7 +79,7 @@ plt.show()
 
 # 贴现因子曲线
 plt.figure(figsize=(10,5))
-plt.plot([m for m,_ in discount_factors], [df for _,df in discount_factors], 'bo-', label='贴现因子')
+plt.plot(maturities, discount_factors, 'bo-', label='贴现因子')
 plt.title('贴现因子曲线 - ' + date_str)
 plt.xlabel('到期期限 (年)')
 plt.ylabel('贴现因子 (DF)')
@@ -99,26 +97,24 @@ notional = 1e6  # 名义本金100万
 start_date = calendar.advance(today, ql.Period(1, ql.Years))
 maturity = calendar.advance(start_date, tenor)  # Swap 到期日
 
-# 固定leg 付息时间表
-fixed_schedule = ql.Schedule(
-    start_date, maturity,
-    ql.Period(ql.Annual),    # 每年付息一次
-    calendar,
-    ql.ModifiedFollowing, ql.ModifiedFollowing,
-    ql.DateGeneration.Backward,  # backward 避免负时间
-    False
-)
-
 # 浮动 leg 付息时间表
 float_schedule = ql.Schedule(
     start_date, maturity,
     ql.Period(ql.Semiannual),       # 每半年付息
     calendar,
     ql.ModifiedFollowing, ql.ModifiedFollowing,
-    ql.DateGeneration.Backward,
+    ql.DateGeneration.Backward,  # backward 避免负时间
     False
 )
 
+# 固定leg 付息时间表: 每年付息一次. 两个时间表都从到期日往回生成, 所以从到期日往回每隔一个半年付息日取一个就是年付息日,
+# 起息日 (可能是短的第一期) 也要保留; 不用再按日历生成一遍
+float_dates = list(float_schedule)
+fixed_dates = float_dates[::-2][::-1]
+if fixed_dates[0] != float_dates[0]:
+    fixed_dates.insert(0, float_dates[0])
+fixed_schedule = ql.Schedule(fixed_dates, calendar, ql.ModifiedFollowing)
+
 # 浮动 利率 Index (6M USD Libor)
 ibro_index = ql.USDLibor(ql.Period(6, ql.Months), yield_curve)
 
@@ -142,6 +138,23 @@ swap.setPricingEngine(engine)
 # 输出swap.NPV
 print(f"\n5年期利率互换 NPV: {swap.NPV():,.2f}")
 
+# ======================解析检验: 平价利率=====================
+# 折现和预测用的是同一条曲线, 浮动 leg 现值约等于 DF(起息日) - DF(到期日),
+# 所以平价利率 = (DF(起息日) - DF(到期日)) / 年金, 年金 = Σ DF(t_i) * τ_i (固定 leg 付息日)
+# 只需要几个贴现因子, 不用建 VanillaSwap 和定价引擎, 适合改参数反复算
+def swap_par_rate(curve, schedule, day_count):
+    pay_dates = list(schedule)
+    taus = np.array([day_count.yearFraction(a, b) for a, b in zip(pay_dates[:-1], pay_dates[1:])])
+    dfs = np.fromiter((curve.discount(d) for d in pay_dates[1:]), dtype=float, count=len(taus))
+    annuity = taus @ dfs
+    return (curve.discount(pay_dates[0]) - curve.discount(pay_dates[-1])) / annuity, annuity
+
+par_rate, annuity = swap_par_rate(yield_curve, fixed_schedule, day_count)
+analytic_npv = notional * (par_rate - fixed_rate) * annuity    # 付固定方: 平价利率高于固定利率时赚钱
+# Libor 按Actual360计息, 浮动 leg 用Actual365Fixed, 所以和QuantLib的结果会差一点
+print(f"平价利率: 解析 {par_rate*100: .4f}%, QuantLib {swap.fairRate()*100: .4f}%")
+print(f"解析 NPV: {analytic_npv:,.2f}")
+
 
 '''
 ==================================总结===========================
@@ -167,6 +180,7 @@ print(f"\n5年期利率互换 NPV: {swap.NPV():,.2f}")
     -NPV > 0：对固定利率收款方有利
     -NPV < 0：对固定利率付款方有利
 -Swap 定价依赖零息曲线折现未来现金流
+-解析检验：平价利率 = (DF(起息日) - DF(到期日)) / 年金，NPV = 名义本金 × (平价利率 - 固定利率) × 年金
 
 5️⃣ 可视化
 -利率曲线和贴现因子曲线直观显示时间价值
@@ -15,8 +15,31 @@ import pandas as pd
 import numpy as np
 import datetime as dt
 from yahooquery import Ticker
-from math import log, sqrt, exp
-from scipy.stats import norm
+from math import log, sqrt, exp, erfc, pi
+
+# numba 可以把函数编译成机器码, 一次算一整条期权链也很快. 没有安装的话就是普通的Python函数
+try:
+    from numba import njit, prange
+except ImportError:
+    prange = range
+
+    def njit(*args, **kwargs):      # 没有numba时, 装饰器什么都不做
+        def decorator(func):
+            return func
+        return decorator
+
+
+# 标准正态分布的累积分布函数和密度函数, 不用每次调用scipy的norm.cdf
+# 用erfc不用 1+erf: x很小(深度虚值)时 1+erf 会变成0, erfc 还能算出很小的数
+@njit(cache=True)
+def norm_cdf(x):
+    return 0.5 * erfc(-x / sqrt(2.0))
+
+
+@njit(cache=True)
+def norm_pdf(x):
+    return exp(-0.5 * x * x) / sqrt(2.0 * pi)
+
 
 # =========Black-Scholes 定价函数===========
 '''black-scholes是用于定价欧式期权的数学模型'''
@@ -26,16 +49,60 @@ K = 执行价
 T = 到期时间(年)
 r = 无风险利率
 sigma = 波动率
-option_type = 看涨/看跌
+is_call = True 看涨 / False 看跌
 '''
-def black_scholes(S, K, T, r, sigma, option_type='call'):
+@njit(cache=True)
+def bs_price(S, K, T, r, sigma, is_call):
     d1 = (log(S/K) + (r + 0.5*sigma**2)* T) / (sigma*sqrt(T))
     d2 = d1 - sigma*sqrt(T)
-    if option_type == "call":
-        price = S*norm.cdf(d1) - K*exp(-r*T)*norm.cdf(d2)
-    else: # put
-        price = K*exp(-r*T)*norm.cdf(-d2) - S*norm.cdf(-d1)
-    return price
+    if is_call:
+        return S*norm_cdf(d1) - K*exp(-r*T)*norm_cdf(d2)
+    return K*exp(-r*T)*norm_cdf(-d2) - S*norm_cdf(-d1)     # put
+
+
+# 一次算一组期权: 参数都是同样长度的数组, 每个位置是一个期权
+@njit(parallel=True, cache=True)
+def bs_prices(S, K, T, r, sigma, is_call):
+    out = np.empty(K.shape[0])
+    for i in prange(K.shape[0]):
+        out[i] = bs_price(S[i], K[i], T[i], r[i], sigma[i], is_call[i])
+    return out
+
+
+# 一次算一组期权的希腊值, 每一行是一个希腊值: Delta, Gamma, Vega(每1%), Theta(每天), Rho(每1%)
+@njit(parallel=True, cache=True)
+def bs_greeks(S, K, T, r, sigma, is_call):
+    out = np.empty((5, K.shape[0]))
+    for i in prange(K.shape[0]):
+        sqrt_T = sqrt(T[i])
+        discount = exp(-r[i]*T[i])
+        d1 = (log(S[i]/K[i]) + (r[i] + 0.5*sigma[i]**2)*T[i]) / (sigma[i]*sqrt_T)
+        d2 = d1 - sigma[i]*sqrt_T
+        pdf_d1 = norm_pdf(d1)
+        out[1, i] = pdf_d1 / (S[i]*sigma[i]*sqrt_T)
+        out[2, i] = S[i] * pdf_d1 * sqrt_T / 100
+        if is_call[i]:
+            out[0, i] = norm_cdf(d1)
+            out[3, i] = (-S[i]*pdf_d1*sigma[i]/(2*sqrt_T) - r[i]*K[i]*discount*norm_cdf(d2)) / 365
+            out[4, i] = K[i]*T[i]*discount*norm_cdf(d2) / 100
+        else:
+            out[0, i] = norm_cdf(d1) - 1
+            out[3, i] = (-S[i]*pdf_d1*sigma[i]/(2*sqrt_T) + r[i]*K[i]*discount*norm_cdf(-d2)) / 365
+            out[4, i] = -K[i]*T[i]*discount*norm_cdf(-d2) / 100
+    return out
+
+
+def compute_greeks(S, K, T, r, sigma, is_call):
+    # 参数可以是数字或数组, 先广播成同样长度的数组; 返回 {'Delta': 数组, ...}
+    S, K, T, r, sigma, is_call = np.broadcast_arrays(*(np.atleast_1d(np.asarray(x, dtype=float)) for x in (S, K, T, r, sigma)),
+                                                     np.atleast_1d(np.asarray(is_call, dtype=bool)))
+    greeks = bs_greeks(*(np.ascontiguousarray(x) for x in (S, K, T, r, sigma, is_call)))
+    return dict(zip(('Delta', 'Gamma', 'Vega', 'Theta', 'Rho'), greeks))
+
+
+def black_scholes(S, K, T, r, sigma, option_type='call'):
+    # option_type 是 'call' 时算看涨, 其它都算看跌
+    return bs_price(S, K, T, r, sigma, option_type == 'call')
 
 # 获取期权数据
 symbol = 'AAPL'
@@ -68,33 +135,44 @@ r = df_r.iloc[-1, 0] / 100      # 转成小数
 print(f"真实无风险利率: r = {r:.4f}")
 
 hist = ticker.history(period='6mo')['close']
-sigma = np.log(hist/hist.shift(1)).std() * np.sqrt(252)     # 历史波动率
+# 历史波动率: 直接在numpy数组上算对数收益率, 不用shift对齐; 有缺失的价格时和pandas的std一样跳过nan
+log_returns = np.diff(np.log(hist.to_numpy(dtype=float)))
+sigma = np.nanstd(log_returns, ddof=1) * sqrt(252)
 
 # ==============计算Black_Scholes 价格============
-bs_price = black_scholes(S0, K, T, r, sigma, option_type='call' if option_type=='calls' else 'put')
-print(f"Black_Scholes 模型价格: {bs_price:.4f}({option_type})")
+# 结果不能叫 bs_price: 会把上面的 bs_price 函数覆盖掉, 后面 bs_prices 编译时就找不到它了
+model_price = black_scholes(S0, K, T, r, sigma, option_type='call' if option_type=='calls' else 'put')
+print(f"Black_Scholes 模型价格: {model_price:.4f}({option_type})")
 print(f"市场价格: {first_row['lastPrice']}")
 
 
 # ==========计算Greeks(敏感性)==================
-d1 = (log(S0/K) + (r + 0.5*sigma**2)*T) / (sigma*sqrt(T))
-d2 = d1 - sigma*sqrt(T)
+# 和整条期权链用同一个函数, 看跌期权也有公式
+greeks = compute_greeks(S0, K, T, r, sigma, option_type == 'calls')
+Delta, Gamma, Vega, Theta, Rho = (greeks[name][0] for name in ('Delta', 'Gamma', 'Vega', 'Theta', 'Rho'))
 
-Delta = norm.cdf(d1) if option_type=="calls" else norm.cdf(d1) -1
-Gamma = norm.pdf(d1) / (S0*sigma*sqrt(T))
-Vega = S0 * norm.pdf(d1) * sqrt(T) / 100
-Theta = (-S0*norm.pdf(d1)*sigma/(2*sqrt(T)) - r*K*exp(-r*T)*norm.cdf(d2)) / 365 if option_type=='calls' else ...
-Rho = K*T*exp(-r*T)*norm.cdf(d2)/100 if option_type=='calls' else ...
+# 半年以后到期的整条期权链, 希腊值一次算完 (波动率都用上面的历史波动率)
+chain_T = (pd.to_datetime(future_options.index.get_level_values('expiration')) - today).days.to_numpy() / 365
+chain_is_call = future_options.index.get_level_values(2) == 'calls'
+chain_greeks = pd.DataFrame(compute_greeks(S0, future_options['strike'].to_numpy(), chain_T, r, sigma, chain_is_call),
+                            index=future_options.index)
+print(chain_greeks.head())
 
 # =======敏感性分析 ( 波动率 和 到期时间)
+# 每组参数一次用bs_prices算完
+is_call = option_type == 'calls'
+vols = np.array([0.1, 0.2, 0.3, 0.5])
+t_years = np.array([0.25, 0.5, 1, 2])
+n = len(vols)
+
 print(f"=====波动率敏感性分析 (Vega)=====")
-for vol in [0.1, 0.2, 0.3, 0.5]:
-    price = black_scholes(S0, K, T, r, vol, option_type)
+vol_prices = bs_prices(np.full(n, S0), np.full(n, K), np.full(n, T), np.full(n, r), vols, np.full(n, is_call))
+for vol, price in zip(vols, vol_prices):
     print(f"波动率{vol*100:.0f}% -> 价格: {price:.4f}")
 
 print(f"=====到期时间敏感性分析 (Theta)===== ")
-for t_year in [0.25, 0.5, 1, 2]:
-    price = black_scholes(S0, K, t_year, r, sigma, option_type)
+t_prices = bs_prices(np.full(n, S0), np.full(n, K), t_years, np.full(n, r), np.full(n, sigma), np.full(n, is_call))
+for t_year, price in zip(t_years, t_prices):
     print(f"到期: {t_year:.2f}年 -> 价格: {price:.4f}")
 
 
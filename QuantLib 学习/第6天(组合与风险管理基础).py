@@ -12,12 +12,42 @@ Day 6：组合与风险管理基础
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from scipy.stats import norm
+from scipy.special import ndtri
+from parquet_cache import read_cached
 
 # 设置中文字体显示
 plt.rcParams['font.sans-serif'] = ['SimHei']  # 使用黑体显示中文
 plt.rcParams['axes.unicode_minus'] = False    # 正常显示负号
 
+# 债券和期权组合用numpy结构化数组保存, 每个字段是一整列: bonds['value'].sum() 直接在连续数组上算
+BOND_DTYPE = np.dtype([
+    ('name', 'O'),          # 债券名称
+    ('value', 'f8'),        # 债券价值
+    ('price', 'f8'),        # 债券价格
+    ('notional', 'f8'),     # 投资面值
+    ('vol', 'f8'),          # 估计波动率
+])
+OPTION_DTYPE = np.dtype([
+    ('name', 'O'),          # 期权名称
+    ('type', 'O'),          # 期权类型
+    ('value', 'f8'),        # 期权总价值
+    ('price', 'f8'),        # 期权单价
+    ('strike', 'f8'),       # 行权价
+    ('quantity', 'i8'),     # 购买手数
+    ('delta', 'f8'),        # Delta值
+    ('vol', 'f8'),          # 波动率
+])
+
+
+def _read_option_sheets(path):
+    sheets = pd.read_excel(path, sheet_name=['Calls', 'Puts'])     # 一次读两个sheet, excel只解析一遍
+    return pd.concat([sheets['Calls'], sheets['Puts']], ignore_index=True)
+
+
+def read_options(path):
+    '''读取期权文件全部的Calls和Puts并合并 (缓存成 xxx.xlsx.calls_puts.parquet, 和第8天只存前50行的缓存分开)'''
+    return read_cached(path, _read_option_sheets, suffix='.calls_puts.parquet')
+
 
 class InteractivePortfolioRiskAnalyzer:
     '''
@@ -43,11 +73,8 @@ class InteractivePortfolioRiskAnalyzer:
             # 加载债券数据
             securities = pd.read_csv('./Securities.csv')
 
-            # 加载AAPL期权数据，分别读取看涨和看跌期权
-            calls = pd.read_excel('AAPL_options.xlsx', sheet_name='Calls')
-            puts = pd.read_excel('AAPL_options.xlsx', sheet_name='Puts')
-            # 合并看涨和看跌期权数据
-            options = pd.concat([calls, puts], ignore_index=True)
+            # 加载AAPL期权数据，看涨和看跌期权合并在一起
+            options = read_options('AAPL_options.xlsx')
 
             # 打印数据加载信息
             print(f"10年期国债收益率: {latest_yield * 100:.2f}%")
@@ -65,7 +92,7 @@ class InteractivePortfolioRiskAnalyzer:
         创建债券投资组合
         让用户交互式选择债券和投资金额
         '''
-        bonds = []  # 存储债券信息的列表
+        rows = []  # 每个债券一行, 最后转成结构化数组
 
         if securities is not None and not securities.empty:
             # 过滤出有价格数据的债券
@@ -108,13 +135,10 @@ class InteractivePortfolioRiskAnalyzer:
                     vol = 0.07
 
                 # 将债券信息添加到列表
-                bonds.append({
-                    'name': f"{bond['Security Type']} {bond.get('Security Term', '')}",
-                    'value': value,             # 债券价值
-                    'price': price,             # 债券价格
-                    'notional': notional,       # 投资面值
-                    'vol': vol                  # 估计波动率
-                })
+                rows.append((f"{bond['Security Type']} {bond.get('Security Term', '')}",
+                             value, price, notional, vol))
+
+        bonds = np.array(rows, dtype=BOND_DTYPE)
 
         # 处理无数据情况
         if len(bonds) == 0:
@@ -133,7 +157,7 @@ class InteractivePortfolioRiskAnalyzer:
         创建期权投资组合
         让用户交互式选择期权和购买数量
         """
-        option_portfolio = []   # 存储期权信息的列表
+        rows = []   # 每个期权一行, 最后转成结构化数组
 
         if options is not None and not options.empty:
             # 过滤有效的期权数据（有价格、行权价、隐含波动率）
@@ -206,18 +230,11 @@ class InteractivePortfolioRiskAnalyzer:
                 moneyness_status = "实值" if (opt['strike'] < 180 and opt_type == '看涨') or (
                     opt['strike'] > 180 and opt_type == "看跌") else '虚值'
 
-                # 创建期权信息字典
-                option_info = {
-                    'name': f"AAPL {opt_type} ${opt['strike']}",
-                    'type': opt_type,        # 期权类型
-                    'value': value,          # 期权总价值
-                    'price': opt['lastPrice'], # 期权单价
-                    'strike': opt['strike'],   # 行权价
-                    'quantity': quantity,    # 购买手数
-                    'delta': delta,          # Delta值
-                    'vol': volatility        # 波动率
-                }
-                option_portfolio.append(option_info)
+                # 期权信息, 顺序和 OPTION_DTYPE 的字段一样
+                rows.append((f"AAPL {opt_type} ${opt['strike']}", opt_type, value, opt['lastPrice'],
+                             opt['strike'], quantity, delta, volatility))
+
+        option_portfolio = np.array(rows, dtype=OPTION_DTYPE)
 
         # 处理无数据情况
         if len(option_portfolio) == 0:
@@ -234,14 +251,15 @@ class InteractivePortfolioRiskAnalyzer:
 
         return option_portfolio
 
-    def monte_carlo_var(self, bonds, options, simulations=5000, days=10):
+    def monte_carlo_var(self, bonds, options, simulations=5000, days=10, rng=None):
         """
         蒙特卡洛模拟计算风险价值(VaR)
         通过模拟市场情景来估计组合的未来价值分布
+        rng: np.random.Generator, 不传的话用种子42新建一个, 每次调用结果都一样
         """
         # 计算当前组合价值
-        bond_value = sum(b['value'] for b in bonds) if bonds else 0
-        option_value = sum(o['value'] for o in options) if options else 0
+        bond_value = bonds['value'].sum()
+        option_value = options['value'].sum()
         total_value = bond_value + option_value
 
         # 检查组合价值是否有效
@@ -257,46 +275,72 @@ class InteractivePortfolioRiskAnalyzer:
         print(f"期权总价值: ${option_value:,.2f}")
         print(f"组合总价值: ${total_value:,.2f}")
 
-        # 计算平均波动率
-        bond_vol = np.mean([b['vol'] for b in bonds]) if bonds else 0
-        option_vols = [o['vol'] for o in options] if options else [0.25]
-        option_vol = np.mean(option_vols)
+        # 计算平均波动率 (只用来显示, 模拟时每个资产用自己的波动率和Delta)
+        bond_vol = bonds['vol'].mean() if len(bonds) else 0
+        option_vol = options['vol'].mean() if len(options) else 0.25
 
         # 计算期权组合平均Delta值
-        option_deltas = [abs(o['delta']) for o in options] if options else [0.5]
-        avg_delta = np.mean(option_deltas)
+        avg_delta = np.abs(options['delta']).mean() if len(options) else 0.5
 
         print(f"债券波动率: {bond_vol:.1%}")
         print(f"期权波动率: {option_vol:.1%}")
         print(f"期权平均Delta: {avg_delta:.2f}")
 
-        # 设置随机数种子确保结果可重现
-        np.random.seed(42)
+        # 设置随机数种子确保结果可重现; 用独立的Generator(PCG64), 比全局的 np.random.seed 更快, 也不影响别的代码
+        if rng is None:
+            rng = np.random.default_rng(42)
         # 计算时间调整因子（将年波动率转换为指定天数的波动率）
         time_factor = np.sqrt(days / 252)  # 252个交易日
 
-        # 生成相关的随机数（债券和股票收益的相关性为30%）
-        correlation = 0.3
-        z1 = np.random.normal(0, 1, simulations)  # 债券随机冲击
-        # 股票随机冲击（与债券相关）
-        z2 = correlation * z1 + np.sqrt(1 - correlation ** 2) * np.random.normal(0, 1, simulations)
-
-        # 计算债券和股票的收益率冲击
-        bond_returns = z1 * bond_vol * time_factor
-        stock_returns = z2 * option_vol * time_factor
-
-        # 模拟未来组合价值
-        future_values = []
-        for i in range(simulations):
-            # 债券价值变化
-            bond_change = bond_value * bond_returns[i] if bonds else 0
-            # 期权价值变化（考虑Delta暴露）
-            option_change = option_value * avg_delta * stock_returns[i] if options else 0
-            # 计算未来价值
-            future_value = total_value + bond_change + option_change
-            future_values.append(future_value)
-
-        return total_value, np.array(future_values)
+        # 每个债券单独模拟, 不再用平均波动率和平均Delta把整个组合压成一个数
+        exposures, corr = self.risk_factors(bonds, options)
+        # 一次抽出 n×N 个独立的标准正态数 U; 相关的冲击是 Z = L @ U (L 是相关矩阵的Cholesky分解, 一行一个风险因子)
+        L = np.linalg.cholesky(corr)
+        U = rng.standard_normal((len(exposures), simulations))
+
+        # 模拟未来组合价值: 所有情景整个数组一起算, 不用一次循环一个情景
+        # 组合价值变化 = Σ 每个风险因子的暴露 × 冲击 = (暴露 @ L × 时间因子) @ U
+        # 先把暴露、L 和时间因子合成一个长度为n的向量, 不用生成 n×N 的 Z 和中间数组, 只扫一遍 U
+        loadings = (exposures @ L) * time_factor
+        future_values = total_value + loadings @ U
+
+        return total_value, future_values
+
+    def risk_factors(self, bonds, options, correlation=0.3, bond_correlation=0.8):
+        """
+        风险因子: 每个债券一个因子, 期权都是AAPL, 共用一个股票因子(最后一个)
+        返回每个因子的年化风险暴露($) 和因子之间的相关矩阵
+        correlation: 债券和股票收益的相关性; bond_correlation: 债券之间的相关性 (都受利率影响)
+        """
+        # 债券暴露 = 价值 × 波动率; 期权暴露 = 价值 × |Delta| × 波动率, 每个期权用自己的Delta和波动率
+        bond_exposures = bonds['value'] * bonds['vol']
+        stock_exposure = (options['value'] * np.abs(options['delta']) * options['vol']).sum()
+        exposures = np.append(bond_exposures, stock_exposure)
+
+        n = len(exposures)
+        corr = np.full((n, n), bond_correlation)
+        corr[-1, :] = correlation
+        corr[:, -1] = correlation
+        np.fill_diagonal(corr, 1.0)
+        return exposures, corr
+
+    def analytic_var(self, bonds, options, days=10):
+        """
+        解析法 (Delta-正态) VaR: 组合价值变化是各风险因子的线性组合, 服从正态分布,
+        VaR 直接等于 分位数 × 组合标准差, 不用模拟. 和 monte_carlo_var 用的是同一套暴露和相关矩阵
+        """
+        exposures, corr = self.risk_factors(bonds, options)
+        # 持有期内组合价值变化的标准差: sqrt(e^T × 相关矩阵 × e) × sqrt(天数/252)
+        sigma_p = np.sqrt(exposures @ corr @ exposures) * np.sqrt(days / 252)
+
+        # 正态分布的分位数 z = -ndtri(α) (95%: 1.6449, 99%: 2.3263), 没有模拟误差
+        # CVaR 也有公式: 尾部平均损失 = σ × φ(z) / α, φ 是标准正态密度
+        risk = {}
+        for level, alpha in (('95%', 0.05), ('99%', 0.01)):
+            z = -ndtri(alpha)
+            risk[f'{level} VaR'] = z * sigma_p
+            risk[f'{level} CVaR'] = sigma_p * np.exp(-0.5 * z * z) / np.sqrt(2 * np.pi) / alpha
+        return risk
 
     def calculate_risk(self, current_value, future_values):
         """
@@ -307,14 +351,29 @@ class InteractivePortfolioRiskAnalyzer:
         # 计算损益分布
         pnl = future_values - current_value
 
-        # 计算95%置信水平的VaR（取第5百分位数的负值）
-        var_95 = -np.percentile(pnl, 5)
-        # 计算99%置信水平的VaR（取第1百分位数的负值）
-        var_99 = -np.percentile(pnl, 1)
+        # VaR只需要最差的5%和1%附近的几个数, 用 np.partition 把它们放到排好序的位置上 (O(n)), 不用整个排序
+        # 百分位数和 np.percentile 一样: 位置 q*(n-1), 在前后两个数之间线性插值
+        n = len(pnl)
+        lo_95 = int(0.05 * (n - 1))
+        lo_99 = int(0.01 * (n - 1))
+        part = np.partition(pnl, sorted({lo_99, min(lo_99 + 1, n - 1), lo_95, min(lo_95 + 1, n - 1)}))
+
+        def lower_tail(q, lo):
+            # 返回 (第q百分位数, 小于等于它的所有损益)
+            # 靠后的数可能和百分位数相等 (有重复的损益), 所以尾部要在整个数组里筛, 不能只取前 lo+2 个
+            hi = min(lo + 1, n - 1)
+            value = part[lo] + (q * (n - 1) - lo) * (part[hi] - part[lo])
+            return value, part[part <= value]
+
+        # 计算95%置信水平的VaR（取第5百分位数的负值）和99%置信水平的VaR（取第1百分位数的负值）
+        q_95, tail_95 = lower_tail(0.05, lo_95)
+        q_99, tail_99 = lower_tail(0.01, lo_99)
+        var_95 = -q_95
+        var_99 = -q_99
 
         # 计算CVaR（超过VaR的所有损失的平均值）
-        cvar_95 = -pnl[pnl <= -var_95].mean()
-        cvar_99 = -pnl[pnl <= -var_99].mean()
+        cvar_95 = -tail_95.mean()
+        cvar_99 = -tail_99.mean()
 
         return {
             '95% VaR': var_95,   # 95%置信水平下的风险价值
@@ -359,8 +418,8 @@ class InteractivePortfolioRiskAnalyzer:
         ax2.grid(True, alpha=0.3)
 
         # 子图3：组合成分饼图
-        bond_total = sum(b['value'] for b in bonds) if bonds else 0
-        option_total = sum(o['value'] for o in options) if options else 0
+        bond_total = bonds['value'].sum()
+        option_total = options['value'].sum()
         if bond_total + option_total > 0:
             ax3.pie([bond_total, option_total], labels=['债券', '期权'], autopct='%1.1f%%',
                     colors=['lightblue', 'lightcoral'])
@@ -401,7 +460,7 @@ class InteractivePortfolioRiskAnalyzer:
         option_portfolio = self.create_option_portfolio(options)
 
         # 检查是否有有效数据
-        if not bonds and not option_portfolio:
+        if len(bonds) == 0 and len(option_portfolio) == 0:
             print(f"没有找到有效的债券或期权数据，无法进行分析")
             return
 
@@ -415,6 +474,11 @@ class InteractivePortfolioRiskAnalyzer:
             # 显示绝对金额和相对百分比
             print(f"  {metric}: ${value:,.2f} ({value / current_value * 100:.2f}%)")
 
+        # 线性(Delta)近似下VaR有公式, 不用模拟; 蒙特卡洛留着画损益分布, 以后也可以换成完整重新定价
+        print(f"\n📐 解析法 (Delta-正态) VaR:")
+        for metric, value in self.analytic_var(bonds, option_portfolio).items():
+            print(f"  {metric}: ${value:,.2f} ({value / current_value * 100:.2f}%)")
+
         # 5. 绘制结果图表
         self.plot_results(pnl, risk_metrics, bonds, option_portfolio)
 
@@ -454,6 +518,7 @@ if __name__ == "__main__":
     -VaR（Value at Risk）：在指定置信水平下可能的最大损失。
     -CVaR（Conditional VaR）：超过 VaR 的平均损失，更关注尾部风险。
     -计算 95% 和 99% 两个置信水平下的 VaR 和 CVaR。
+    -解析法（Delta-正态）：VaR = 分位数 × 组合标准差，和蒙特卡洛结果对照。
 
 5. 结果可视化
     -绘制组合 损益分布直方图，标记 VaR 水平线。
@@ -17,14 +17,75 @@ import matplotlib.pyplot as plt
 import scipy.optimize as sco
 import QuantLib as ql
 import os
+from concurrent.futures import ThreadPoolExecutor
+from parquet_cache import read_cached
+from math import sqrt
 from datetime import datetime, timedelta
 
+# numba 可以把循环编译成机器码. 没有安装的话就直接用Python循环
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):      # 没有numba时, 装饰器什么都不做
+        def decorator(func):
+            return func
+        return decorator
+
 
 
 # 设置中文字体,
 plt.rcParams['font.sans-serif'] = ['SimHei']
 plt.rcParams['axes.unicode_minus'] = False
 
+
+# SLSQP 每一步都要算很多次目标函数, 15只股票的矩阵很小, 直接两层循环比每次调用numpy快
+@njit(cache=True)
+def portfolio_volatility(w, cov):
+    ''' 组合波动率 = sqrt(w^T * 协方差矩阵 * w) '''
+    n = w.shape[0]
+    acc = 0.0
+    for i in range(n):
+        s = 0.0
+        for j in range(n):
+            s += cov[i, j] * w[j]
+        acc += w[i] * s
+    return sqrt(acc)
+
+
+@njit(cache=True)
+def portfolio_sharpe(w, mu, cov, rf):
+    ''' 夏普比率 = (组合收益 - 无风险利率) / 组合波动率; 波动率为0时返回0 '''
+    port_return = 0.0
+    for i in range(w.shape[0]):
+        port_return += w[i] * mu[i]
+    port_vol = portfolio_volatility(w, cov)
+    if port_vol == 0:
+        return 0.0
+    return (port_return - rf) / port_vol
+
+
+# 目标函数的梯度有公式, 传给SLSQP就不用每一步再算 n+1 次目标函数做数值差分
+@njit(cache=True)
+def portfolio_volatility_grad(w, cov):
+    ''' 组合波动率对权重的梯度 = 协方差矩阵 * w / 波动率 '''
+    cov_w = cov @ w
+    return cov_w / sqrt(w @ cov_w)
+
+
+@njit(cache=True)
+def neg_sharpe_grad(w, mu, cov, rf):
+    ''' 负夏普比率对权重的梯度 = -(mu / 波动率 - (组合收益 - 无风险利率) * 协方差矩阵 * w / 波动率^3) '''
+    cov_w = cov @ w
+    port_vol = sqrt(w @ cov_w)
+    port_return = w @ mu
+    return -(mu / port_vol - (port_return - rf) * cov_w / port_vol ** 3)
+
+
+# 读取一个股票文件, index_col=0表示第一列作为索引 (通常是日期); 缓存成 xxx_stock.xlsx.parquet
+def read_stock_file(file):
+    return read_cached(file, lambda f: pd.read_excel(f, index_col=0))
+
+
 class SmartPortfolioOptimizer:
     '''
     智能投资组合优化器类
@@ -37,6 +98,14 @@ class SmartPortfolioOptimizer:
         '''
         self.risk_free_rate = 0.02  # 无风险利率, 默认2%
         self.max_stocks = max_stocks
+        self.w_vec = None           # 优化后的权重向量 (float64数组, 顺序和收益率表的列一样)
+
+    def _load_one(self, file):
+        '''在线程里读取一个股票文件, 返回 (文件名, 数据, 错误); 出错时不打印, 留给主线程按顺序打印'''
+        try:
+            return file, read_stock_file(file), None
+        except Exception as e:
+            return file, None, e
 
     def load_all_stock_data(self):
         '''
@@ -55,22 +124,42 @@ class SmartPortfolioOptimizer:
 
         stock_data = {} # 用于存储所有股票数据
 
-        # 遍历每个股票文件并加载数据
-        for file in sorted(stock_files):    # sorted 确保按字母顺序处理
-            try:
-                # 从文件名提取股票代码: AAPL_stock.xlsx -->AAPL
-                stock_code = file.replace('_stock.xlsx', '')
-                # 读取excel文件, index_col=0表示第一列作为索引 (通常是日期)
-                df = pd.read_excel(file, index_col=0)
-                # 验证数据格式, 必须有Close列且数据不为空
-                if 'Close' in df.columns and not df.empty:
-                    stock_data[stock_code] = df # 存储到字典中
-                    print(f"加载{stock_code}: {len(df)}个交易日数据")
-            except Exception as e:
-                print(f"加载{file} 失败:{e}")
+        # 多线程同时读取所有文件; ex.map 按输入顺序返回, 打印的顺序和以前一样
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            results = list(ex.map(self._load_one, sorted(stock_files)))    # sorted 确保按字母顺序处理
+
+        for file, df, error in results:
+            # 从文件名提取股票代码: AAPL_stock.xlsx -->AAPL
+            stock_code = file.replace('_stock.xlsx', '')
+            if error is not None:
+                print(f"加载{file} 失败:{error}")
+            # 验证数据格式, 必须有Close列且数据不为空
+            elif 'Close' in df.columns and not df.empty:
+                stock_data[stock_code] = df # 存储到字典中
+                print(f"加载{stock_code}: {len(df)}个交易日数据")
         print(f"\n 成功加载 {len(stock_data)}只股票")
         return stock_data
 
+    def _daily_returns(self, stock_data):
+        '''
+        把所有股票的日收益率放到一个宽表里, 一列一只股票
+        每只股票先在自己的日期上算 pct_change, 再按日期对齐; 某只股票没有的日期是NaN
+        '''
+        return pd.concat({ticker: df['Close'].pct_change() for ticker, df in stock_data.items()}, axis=1, sort=True)
+
+    def _annual_stats(self, returns):
+        '''
+        对收益率宽表的每一列一起计算年化收益率、年化波动率和夏普比率 (NaN自动跳过)
+        '''
+        annual_return = returns.mean() * 252                # 年化收益率 (252个交易日)
+        annual_vol = returns.std() * np.sqrt(252)           # 年化波动率
+        # 夏普比率: (年化收益 - 无风险利率) / 年化波动率; 波动率为0的股票给-10, 排到最后
+        sharpe_ratio = ((annual_return - self.risk_free_rate) / annual_vol).where(annual_vol > 0, -10)
+        return pd.DataFrame({'annual_return': annual_return,
+                             'annual_vol': annual_vol,
+                             'sharpe_ratio': sharpe_ratio,
+                             'trading_days': returns.count()})
+
     def filter_stocks_by_performance(self, stock_data, min_trading_days = 1000):
         '''
         根据股票表现筛选优质股票
@@ -81,56 +170,21 @@ class SmartPortfolioOptimizer:
         '''
         print(f"\n 筛选股票 (最少{min_trading_days}个交易日)")
 
-        filtered_stocks = {}    # 存储筛选后的股票数据
-        performance_stats = {}  # 存储每只股票的性能指标
-        # 遍历每只股票, 计算关键性能指标
-        for ticker, df in stock_data.items():
-            # 首先检查交易天数是否满足要求
-            if len(df) < min_trading_days:
-                continue    # 跳过不满足天数要求的数据
-            try:
-                # 计算日收益率: 今日收盘价/昨日收盘价 - 1
-                returns = df['Close'].pct_change().dropna()
-                # 再次检查收益率数据的长度
-                if len(returns) < min_trading_days:
-                    continue
-
-                # 计算关键金融指标
-                daily_return = returns.mean()           # 日均收益率
-                daily_vol = returns.std()               # 日波动率 (标准差)
-                annual_return = daily_return * 252      # 年化收益率 (252个交易日)
-                annual_vol = daily_vol * np.sqrt(252)   # 年化波动率
-
-                # 计算夏普比率: (年化收益 - 无风险利率) / 年化波动率
-                # 夏普比率衡量每单位风险获得的超额收益
-                sharpe_ratio = (annual_return - self.risk_free_rate) / annual_vol if (
-                        annual_vol > 0) else -10
-                # 存储性能指标
-                performance_stats[ticker] = {
-                    'annual_return': annual_return,
-                    'annual_vol': annual_vol,
-                    'sharpe_ratio': sharpe_ratio,
-                    'trading_days': len(returns)
-                }
-                filtered_stocks[ticker] = df # 存储通过初步筛选的股票
-            except Exception as e:
-                print(f" 分析{ticker}失败: {e}")
-
-        # 按夏普比率从高到底排序, 选择表现最好的股票
-        # sorted函数: 对performance_stats字典按夏普比率降序排列
-        sorted_stocks = sorted(performance_stats.items(),
-                               key=lambda x: x[1]['sharpe_ratio'],
-                               reverse=True)
-        selected_stocks = {}    # 最终选择的股票
-        selected_count = min(self.max_stocks, len(sorted_stocks))   # 实际选择数量
-        print(f" \n 选择前{selected_count}只表现最好的股票:")
+        # 所有股票的收益率放在一个表里, 所有指标按列一起算, 不用一只一只循环
+        stats = self._annual_stats(self._daily_returns(stock_data))
+        # 收益率天数不够的股票跳过
+        stats = stats[stats['trading_days'] >= min_trading_days]
+
+        # 按夏普比率从高到底排序, 选择表现最好的前N只股票
+        top = stats.sort_values('sharpe_ratio', ascending=False, kind='stable').head(self.max_stocks)
+        print(f" \n 选择前{len(top)}只表现最好的股票:")
 
-        # 遍历排序后的股票, 选择前selected_count只
-        for i, (ticker, stats) in enumerate(sorted_stocks[:selected_count]):
+        selected_stocks = {}    # 最终选择的股票
+        for i, (ticker, row) in enumerate(top.iterrows()):
             selected_stocks[ticker] = stock_data[ticker]    # 从原始数据获取完整数据
             # 格式化输出股票信息
-            print(f"{i+1:2d}. {ticker}: 夏普{stats['sharpe_ratio']:+.2f},"
-                  f"年化{stats['annual_return']:.2%}, 波动{stats['annual_vol']:.2%}")
+            print(f"{i+1:2d}. {ticker}: 夏普{row['sharpe_ratio']:+.2f},"
+                  f"年化{row['annual_return']:.2%}, 波动{row['annual_vol']:.2%}")
         return selected_stocks
 
     def calculate_returns(self, stock_data):
@@ -141,27 +195,15 @@ class SmartPortfolioOptimizer:
         返回: 包含所有股票收益率的DataFrame
         '''
         print(f"\n 计算股票收益率........")
-        returns_data = {}   # 存储每只股票的收益率序列
-
-        for ticker, df in stock_data.items():
-            try:
-                # 计算日收益率: (今日收盘价 - 昨日收盘价) / 昨日收盘价
-                returns = df['Close'].pct_change().dropna()
-                returns_data[ticker] = returns    # 存储到字典
-                # 计算显示关键指标
-                daily_return = returns.mean()
-                daily_vol = returns.std()
-                annual_return = daily_return * 252
-                annual_vol = daily_vol * np.sqrt(252)
-                sharpe_ratio = (annual_return - self.risk_free_rate) / annual_vol
-
-                # 输出每只股票的计算数据
-                print(f" {ticker}: 夏普{sharpe_ratio:+.2%}, 年化{annual_return:+.2%}, 波动{annual_vol:.2%}")
-            except Exception as e:
-                print(f" 计算{ticker} 收益率失败: {e}")
-
-        # 将收益率字典转为DataFrame, 并删除包含NaN的行
-        returns_df = pd.DataFrame(returns_data).dropna()
+        returns = self._daily_returns(stock_data)
+        stats = self._annual_stats(returns)
+
+        # 输出每只股票的计算数据
+        for ticker, row in stats.iterrows():
+            print(f" {ticker}: 夏普{row['sharpe_ratio']:+.2%}, 年化{row['annual_return']:+.2%}, 波动{row['annual_vol']:.2%}")
+
+        # 删除包含NaN的行 (有股票没有数据的日期)
+        returns_df = returns.dropna()
         print(f" \n 最终收益率数据框形状: {returns_df.shape}")
         return returns_df
 
@@ -182,27 +224,34 @@ class SmartPortfolioOptimizer:
         print(f" 优化资产数量: {n_assets}")
 
         # 设置优化约束条件: 权重之和必须等于1 (100%)
-        constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
+        constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1, 'jac': lambda x: np.ones_like(x)})
         # 设置边界条件: 每个权重在 0 到 1 之间 ( 不允许卖空)
         bounds = tuple((0,1) for _ in range(n_assets))
 
         # 初始猜测: 等权重分配
         initial_weights = n_assets * [1.0 / n_assets]
+        # 目标函数里直接用numpy数组和编译好的函数, 不用每次都经过pandas
+        mu = expected_returns.to_numpy()
+        cov = cov_matrix.to_numpy()
+        rf = self.risk_free_rate
         # 根据优化方法选择目标函数
         if method == 'sharpe':
             # 最大化夏普比率 = 最小化负夏普比率
-            objective = lambda w: -self._calculate_sharpe(w, expected_returns, cov_matrix)
+            objective = lambda w: -portfolio_sharpe(w, mu, cov, rf)
+            gradient = lambda w: neg_sharpe_grad(w, mu, cov, rf)
         else:
             # 最小化波动率 ( 方差)
-            objective = lambda w: self._calculate_sharpe(w, cov_matrix)
+            objective = lambda w: portfolio_volatility(w, cov)
+            gradient = lambda w: portfolio_volatility_grad(w, cov)
 
-        # 使用SLSQP算法进行序列最小二乘规划优化
-        result = sco.minimize(objective, initial_weights,
+        # 使用SLSQP算法进行序列最小二乘规划优化, jac 是目标函数的梯度
+        result = sco.minimize(objective, initial_weights, jac=gradient,
                               method='SLSQP', bounds=bounds, constraints=constraints)
 
         # 检查优化是否成功
         if result.success:
             optimal_weights = result.x  # 最优权重向量
+            self.w_vec = optimal_weights
             portfolio_return = np.sum(optimal_weights * expected_returns)   # 组合期望收益
             portfolio_vol = self._calculate_volatility(optimal_weights, cov_matrix) # 组合波动率
             sharpe_ratio = self._calculate_sharpe(optimal_weights, expected_returns, cov_matrix)    # 夏普比率
@@ -220,18 +269,16 @@ class SmartPortfolioOptimizer:
         计算夏普比率的辅助函数
         公式: 夏普比率 = (组合收益 - 无风险利率) / 组合波动率
         '''
-        port_return = np.sum(weights * expected_returns)    # 组合期望收益
-        port_vol = self._calculate_volatility(weights, cov_matrix)  # 组合波动率
-        if port_vol == 0:
-            return 0        # 避免除零错误
-        return (port_return - self.risk_free_rate) / port_vol
+        # 波动率为0时返回0, 避免除零错误
+        return portfolio_sharpe(np.asarray(weights, dtype=float), np.asarray(expected_returns, dtype=float),
+                                np.asarray(cov_matrix, dtype=float), self.risk_free_rate)
 
     def _calculate_volatility(self, weights, cov_matrix):
         '''
         计算组合波动率的辅助函数
         公式: 波动率 = sqrt(权重^T * 协方差矩阵 * 权重)
         '''
-        return np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
+        return portfolio_volatility(np.asarray(weights, dtype=float), np.asarray(cov_matrix, dtype=float))
 
     def _equal_weight_fallback(self, returns_df, expected_returns, cov_matrix):
         '''
@@ -247,6 +294,7 @@ class SmartPortfolioOptimizer:
         port_vol = self._calculate_volatility(equal_weights, cov_matrix)
         sharpe_ratio = self._calculate_sharpe(equal_weights, expected_returns, cov_matrix)
 
+        self.w_vec = equal_weights
         weights_dict = dict(zip(returns_df.columns, equal_weights))
         return weights_dict, (port_return, port_vol, sharpe_ratio)
 
@@ -271,11 +319,12 @@ class SmartPortfolioOptimizer:
             print(f"所有股票权重都太小, 返回原始权重")
             return weights
 
-    def efficient_frontier_analysis(self, returns_df):
+    def efficient_frontier_analysis(self, returns_df, rng=None):
         """
         有效前沿分析
         功能：通过蒙特卡洛模拟生成有效前沿，展示风险收益权衡
         有效前沿：在给定风险水平下能获得的最大收益边界
+        rng: np.random.Generator, 不传的话用种子42新建一个, 每次运行画出的前沿都一样
         """
         print("\n 生成有效前沿...")
 
@@ -284,23 +333,28 @@ class SmartPortfolioOptimizer:
         n_assets = len(expected_returns)
 
         n_portfolios = 5000 # 模拟的投资组合数量
-        results = np.zeros((3, n_portfolios))   # 存储结果: 收益, 风险, 夏普比率
-
-        # 蒙特卡洛模拟：随机生成权重，计算组合表现
-        for i in range(n_portfolios):
-            # 生成随机权重
-            weights = np.random.random(n_assets)
-            weights /= weights.sum()    # 归一化权重
-            # 计算组合表现
-            port_return = np.sum(weights * expected_returns)
-            port_vol = self._calculate_volatility(weights, cov_matrix)
-            sharpe_ratio = self._calculate_sharpe(weights, expected_returns, cov_matrix)
-            # 存储结果
-            results[0, i] = port_return # 收益
-            results[1, i] = port_vol    # 风险
-            results[2, i] = sharpe_ratio    # 夏普比率
+
+        # 蒙特卡洛模拟：一次生成所有组合的随机权重 (一行一个组合)，所有组合的表现一起算
+        if rng is None:
+            rng = np.random.default_rng(42)     # 独立的随机数生成器, 不用全局的 np.random 状态
+        weights = rng.random((n_portfolios, n_assets))
+        weights /= weights.sum(axis=1, keepdims=True)    # 每行归一化权重
+        mu = expected_returns.to_numpy()
+        cov = cov_matrix.to_numpy()
+        port_returns = weights @ mu                                              # 收益
+        port_vols = np.sqrt(np.einsum('pi,ij,pj->p', weights, cov, weights))     # 风险: 每行的 w^T Σ w
+        sharpe_ratios = np.where(port_vols > 0, (port_returns - self.risk_free_rate) / port_vols, 0)    # 夏普比率
+        # 存储结果: 收益, 风险, 夏普比率
+        results = np.vstack([port_returns, port_vols, sharpe_ratios])
         return results
 
+    def _portfolio_returns(self, returns_df):
+        '''
+        组合的日收益率 = 收益率矩阵 @ 权重向量, 一次矩阵乘法, 不用先生成 returns_df * 权重 的整张表再按行求和
+        权重向量在优化时已经保存好 (self.w_vec), 不用每次再从字典转换
+        '''
+        return pd.Series(returns_df.to_numpy() @ self.w_vec, index=returns_df.index)
+
     def plot_optimization_results(self, returns_df, weights, performance, efficient_frontier=None):
         """
         绘制优化结果图表
@@ -359,12 +413,13 @@ class SmartPortfolioOptimizer:
         significant_stocks = [k for k, v in weights.items() if v >= 0.01]
         if not significant_stocks:
             significant_stocks = list(weights.keys())[:6]   # 如果没用, 显示前6只
-        # 绘制每只重要股票的累积收益率曲线
-        for ticker in significant_stocks:
-            cumulative = (1 + returns_df[ticker]).cumprod() # 计算累积收益
-            ax3.plot(cumulative.index, cumulative, label=ticker, alpha=0.8, linewidth=2)
+        # 绘制每只重要股票的累积收益率曲线: 一次cumprod算出所有股票的累积收益 (一列一只), 一次plot画出所有线
+        cumulative = np.cumprod(1 + returns_df[significant_stocks].to_numpy(), axis=0)
+        lines = ax3.plot(returns_df.index, cumulative, alpha=0.8, linewidth=2)
+        for line, ticker in zip(lines, significant_stocks):
+            line.set_label(ticker)
         # 计算并绘制投资组合的累积收益率
-        portfolio_returns = (returns_df * list(weights.values())).sum(axis=1)
+        portfolio_returns = self._portfolio_returns(returns_df)
         portfolio_cumulative = ( 1 + portfolio_returns).cumprod()
         ax3.plot(portfolio_cumulative.index, portfolio_cumulative,
                  label='投资组合', linewidth=3, color='black', linestyle='--')
@@ -392,10 +447,10 @@ class SmartPortfolioOptimizer:
         plt.tight_layout()
         plt.show()
 
-    def risk_analysis(self, returns_df, weights):
+    def risk_analysis(self, returns_df):
         print(f"\n 风险分析")
         # 计算投资组合的日收益率
-        portfolio_returns = (returns_df * list(weights.values())).sum(axis=1)
+        portfolio_returns = self._portfolio_returns(returns_df)
 
         # VaR计算 (Value at Risk)
         # 95% VaR: 有95% 的把握损失不会超过这个值
@@ -403,9 +458,9 @@ class SmartPortfolioOptimizer:
         # 99% VaR: 有99% 的把握损失不会超过这个值
         var_99 = -np.percentile(portfolio_returns, 1) * 100
 
-        # 最大回撤计算
-        cumulative = (1+ portfolio_returns).cumprod()   # 累积收益
-        running_max = cumulative.expanding().max()      # 运行最大值
+        # 最大回撤计算 (直接用numpy数组, 不用pandas的expanding窗口)
+        cumulative = np.cumprod(1 + portfolio_returns.to_numpy())  # 累积收益
+        running_max = np.maximum.accumulate(cumulative)     # 运行最大值
         drawdown = (cumulative - running_max) / running_max # 回撤比列
         max_drawdown = drawdown.min() * 100             # 最大回撤
 
@@ -454,7 +509,7 @@ class SmartPortfolioOptimizer:
                 print(f"{stock}: {weight:.2%}")
 
             # 5. 风险分析
-            self.risk_analysis(returns_df, weights)
+            self.risk_analysis(returns_df)
             #6.
             efficient_frontier = self.efficient_frontier_analysis(returns_df)
             # 7. 可视化
@@ -12,8 +12,33 @@ Day 8：综合实战项目
 import pandas as pd
 import numpy as np
 import QuantLib as ql
-from scipy.optimize import minimize
+from concurrent.futures import ThreadPoolExecutor
 import glob, os
+from parquet_cache import read_cached
+
+
+# 读取一个期权文件的Calls和Puts(各取前50行)
+def _read_option_sheets(f):
+    sheets = pd.read_excel(f, sheet_name=['Calls', 'Puts'])     # 一次读两个sheet, excel只解析一遍
+    calls = sheets['Calls'].head(50)
+    puts = sheets['Puts'].head(50)
+    calls['optionType']='Call'
+    puts['optionType']='Put'
+    df = pd.concat([calls, puts], ignore_index=True)
+    df['Source_File'] = os.path.basename(f)
+    return df
+
+
+# 第一次读完保存成 xxx.xlsx.parquet, 之后直接读parquet; 读不了的文件返回None
+def read_option_file(f):
+    try:
+        return read_cached(f, _read_option_sheets)
+    except:
+        return None
+
+
+# 每只债券的特征信息: 类型, 期限, 到期收益率, 久期(年), 价格
+BOND_DTYPE = np.dtype([('type', 'O'), ('term', 'O'), ('yield', 'f8'), ('duration', 'i4'), ('price', 'f8')])
 
 
 # ----------------------------
@@ -25,10 +50,17 @@ class QuantitativePortfolioAnalyzer:
         self.bonds = None              # 债券数据
         self.treasury = None           # 国债收益率数据
         self.options = None            # 期权数据
-        self.bond_characteristics = [] # 每只债券的特征信息
+        self.bond_characteristics = None # 每只债券的特征信息 (结构化数组, 每个字段一列)
         self.optimal_weights = None    # 优化后的组合权重
         self.portfolio_metrics = {}    # 投资组合指标
         self.rf_rate = 0.04            # 默认无风险利率
+        self.schedules = {}            # 每个期限(年)的付息时间表, 债券之间共用
+        self.day_count = None          # 债券共用的日计数方法
+        # 期权定价用的报价: 定价过程和引擎只建一次, 之后每次只更新报价
+        self.spot_quote = ql.SimpleQuote(0.0)   # 标的价格
+        self.rf_quote = ql.SimpleQuote(0.0)     # 无风险利率
+        self.vol_quote = ql.SimpleQuote(0.0)    # 波动率
+        self.option_engine = None
 
     # ----------------------------
     # 加载数据
@@ -52,20 +84,10 @@ class QuantitativePortfolioAnalyzer:
             print(f"国债加载失败: {e}")
             return False
 
-        # 加载期权数据
+        # 加载期权数据: 5个文件用线程一起读, 读不了的文件跳过
         option_files = glob.glob('./*_options.xlsx')
-        option_data = []
-        for f in option_files[:5]:   # 只取前5个期权文件
-            try:
-                calls = pd.read_excel(f, sheet_name='Calls').head(50)
-                puts = pd.read_excel(f, sheet_name='Puts').head(50)
-                calls['optionType']='Call'
-                puts['optionType']='Put'
-                df = pd.concat([calls, puts], ignore_index=True)
-                df['Source_File'] = os.path.basename(f)
-                option_data.append(df)
-            except:
-                continue
+        with ThreadPoolExecutor(max_workers=5) as ex:
+            option_data = [df for df in ex.map(read_option_file, option_files[:5]) if df is not None]   # 只取前5个期权文件
         if option_data:
             self.options = pd.concat(option_data, ignore_index=True)
             print(f"期权数据: {len(self.options)}个")
@@ -78,69 +100,70 @@ class QuantitativePortfolioAnalyzer:
     # 债券分析
     # ----------------------------
     def analyze_bonds(self):
-        latest_treasury = self.treasury.iloc[-1]
-        self.bond_characteristics = []
-
-        for idx, bond in self.bonds.iterrows():
-            security_type = bond.get('Security Type', 'Unknown')
-            security_term = bond.get('Security Term', '1-year')
-
-            # 根据期限选择收益率
-            if '10-year' in str(security_term):
-                ytm = latest_treasury['DGS10']/100
-                duration=10
-            elif '5-year' in str(security_term):
-                ytm = latest_treasury['DGS5']/100
-                duration=5
-            else:
-                ytm = latest_treasury['DGS2']/100
-                duration=2
-
-            # QuantLib 定价
-            try:
-                today = ql.Date.todaysDate()
-                ql.Settings.instance().evaluationDate = today
-                schedule = ql.Schedule(today, today+ql.Period(duration, ql.Years),
-                                       ql.Period(ql.Annual), ql.NullCalendar(),
-                                       ql.Unadjusted, ql.Unadjusted,
-                                       ql.DateGeneration.Backward, False)
-                bond_ql = ql.FixedRateBond(1, 100, schedule, [ytm], ql.ActualActual())
-                bond_price = bond_ql.cleanPrice()   # 获取债券价格
-            except:
-                bond_price = 100  # 默认价格
-
-            self.bond_characteristics.append({
-                'type': security_type,
-                'term': security_term,
-                'yield':ytm,
-                'duration': duration,
-                'price': bond_price
-            })
+        # 最新一天的国债收益率直接取成float, 不用先取整行Series再按列名查
+        rates = {col: float(self.treasury[col].iat[-1]) for col in ('DGS10', 'DGS5', 'DGS2')}
+        bonds = self.bonds
+        security_type = bonds['Security Type'] if 'Security Type' in bonds else pd.Series('Unknown', index=bonds.index)
+        security_term = bonds['Security Term'] if 'Security Term' in bonds else pd.Series('1-year', index=bonds.index)
+
+        # 根据期限选择收益率: 整列一起判断, 不用iterrows一行一行看
+        term = security_term.astype(str)
+        is_10y = term.str.contains('10-year', regex=False).to_numpy()
+        is_5y = term.str.contains('5-year', regex=False).to_numpy()
+        duration = np.select([is_10y, is_5y], [10, 5], default=2)
+        ytm = np.select([is_10y, is_5y], [rates['DGS10'], rates['DGS5']], default=rates['DGS2']) / 100
+
+        # 期限和收益率一样的债券价格也一样, QuantLib 每组只定价一次
+        today = ql.Date.todaysDate()
+        ql.Settings.instance().evaluationDate = today
+        self.schedules = {}     # 时间表从今天开始, 每次分析重新建
+        keys = list(zip(duration, ytm))
+        prices = {key: self.price_bond(today, *key) for key in set(keys)}
+
+        # 用numpy结构化数组保存, 按字段取出来就是连续的float数组, 求平均不用经过pandas
+        bc = np.empty(len(bonds), dtype=BOND_DTYPE)
+        bc['type'] = security_type.to_numpy()
+        bc['term'] = security_term.to_numpy()
+        bc['yield'] = ytm
+        bc['duration'] = duration
+        bc['price'] = [prices[key] for key in keys]
+        self.bond_characteristics = bc
 
         # 计算平均债券收益率
-        self.avg_bond_yield = np.mean([b['yield'] for b in self.bond_characteristics])*100
+        self.avg_bond_yield = self.bond_characteristics['yield'].mean()*100
         print(f"平均债卷收益率: {self.avg_bond_yield:.2f}%")
         return True
 
+    # QuantLib 定价: 每年付息一次的固定利率债券, 票面利率等于到期收益率
+    # 同一个期限的时间表和日计数方法只建一次, 每只债券只要新建 FixedRateBond
+    def price_bond(self, today, duration, ytm):
+        try:
+            if duration not in self.schedules:
+                self.schedules[duration] = ql.Schedule(today, today+ql.Period(int(duration), ql.Years),
+                                                       ql.Period(ql.Annual), ql.NullCalendar(),
+                                                       ql.Unadjusted, ql.Unadjusted,
+                                                       ql.DateGeneration.Backward, False)
+            if self.day_count is None:
+                self.day_count = ql.ActualActual()
+            bond_ql = ql.FixedRateBond(1, 100, self.schedules[duration], [float(ytm)], self.day_count)
+            return bond_ql.cleanPrice()   # 获取债券价格
+        except:
+            return 100  # 默认价格
+
     # ----------------------------
     # 期权分析
     # ----------------------------
     def analyze_options(self):
-        vols =[]
-        strikes = []
-
-        # 提取隐含波动率和行权价
-        for idx, row in self.options.iterrows():
-            iv = pd.to_numeric(row.get('impliedVolatility', np.nan), errors='coerce')
-            strike=pd.to_numeric(row.get('strike', np.nan), errors='coerce')
-            if not pd.isna(iv) and iv>0:
-                vols.append(iv)
-            if not pd.isna(strike):
-                strikes.append(strike)
+        # 提取隐含波动率和行权价: 整列一起转成数字, 转不了的变成nan, 不用iterrows一行一行转
+        # 转好以后马上变成numpy数组, 后面的筛选和中位数都直接在数组上算
+        iv = pd.to_numeric(self.options.get('impliedVolatility', pd.Series(dtype=float)), errors='coerce').to_numpy(dtype=float)
+        strike = pd.to_numeric(self.options.get('strike', pd.Series(dtype=float)), errors='coerce').to_numpy(dtype=float)
+        vols = iv[iv > 0]       # nan > 0 是False, 也一起去掉了
+        strikes = strike[~np.isnan(strike)]
 
         # 使用中位数波动率和平均行权价
-        self.avg_option_vol = np.median(vols)*100 if vols else 50
-        self.underlying_price = np.mean(strikes)*1.05 if strikes else 200
+        self.avg_option_vol = np.median(vols)*100 if vols.size else 50
+        self.underlying_price = np.mean(strikes)*1.05 if strikes.size else 200
         print(f"平均期权隐含波动率: {self.avg_option_vol:.2f}%")
         return True
 
@@ -156,15 +179,13 @@ class QuantitativePortfolioAnalyzer:
         exercise = ql.EuropeanExercise(today+ql.Period(90, ql.Days))
         option = ql.VanillaOption(payoff, exercise)
 
-        # 构建定价过程
-        spot = ql.QuoteHandle(ql.SimpleQuote(self.underlying_price))
-        flat_ts = ql.YieldTermStructureHandle(ql.FlatForward(today, self.rf_rate, ql.Actual365Fixed()))
-        div_ts = ql.YieldTermStructureHandle(ql.FlatForward(today, 0.01, ql.Actual365Fixed()))
-        vol_ts = ql.BlackVolTermStructureHandle(
-            ql.BlackConstantVol(today, ql.NullCalendar(), self.avg_option_vol/100, ql.Actual365Fixed()))
-        process = ql.BlackScholesMertonProcess(spot, div_ts, flat_ts, vol_ts)
-
-        option.setPricingEngine(ql.AnalyticEuropeanEngine(process))
+        # 更新报价; 定价过程和引擎第一次用到时才建
+        self.spot_quote.setValue(self.underlying_price)
+        self.rf_quote.setValue(self.rf_rate)
+        self.vol_quote.setValue(self.avg_option_vol/100)
+        if self.option_engine is None:
+            self.option_engine = self.build_option_engine()
+        option.setPricingEngine(self.option_engine)
 
         # 计算希腊值
         self.option_delta = option.delta()
@@ -174,31 +195,35 @@ class QuantitativePortfolioAnalyzer:
         print(f"期权希腊值计算完成: Delta={self.option_delta:.3f}, Gamma={self.option_gamma:.6f}")
         return True
 
+    # 构建定价过程: 曲线用结算天数0, 参考日跟着evaluationDate走, 所以可以一直重复使用
+    def build_option_engine(self):
+        day_count = ql.Actual365Fixed()
+        spot = ql.QuoteHandle(self.spot_quote)
+        flat_ts = ql.YieldTermStructureHandle(ql.FlatForward(0, ql.NullCalendar(), ql.QuoteHandle(self.rf_quote), day_count))
+        div_ts = ql.YieldTermStructureHandle(ql.FlatForward(0, ql.NullCalendar(), 0.01, day_count))
+        vol_ts = ql.BlackVolTermStructureHandle(
+            ql.BlackConstantVol(0, ql.NullCalendar(), ql.QuoteHandle(self.vol_quote), day_count))
+        process = ql.BlackScholesMertonProcess(spot, div_ts, flat_ts, vol_ts)
+        return ql.AnalyticEuropeanEngine(process)
+
     # ----------------------------
     # 投资组合优化
     # ----------------------------
     def optimize_portfolio(self):
-        np.random.seed(42)
-
-        # 模拟日收益
+        # 日收益的均值和波动率 (债券 0.1%, 期权 2%), 两者不相关
         bond_daily=self.avg_bond_yield/100/252
         option_daily = self.avg_option_vol/100/252
-        bond_returns = np.random.normal(bond_daily, 0.001, 10000)
-        option_returns = np.random.normal(option_daily, 0.02, 10000)
-
-        # 最大夏普比率优化
-        def objective(w):
-            r = w[0]*bond_returns + w[1]*option_returns
-            return -np.mean(r)/np.std(r)
+        mu = np.array([bond_daily, option_daily])
+        cov = np.diag(np.array([0.001, 0.02])**2)
 
-        cons = ({'type':'eq', 'fun': lambda w: np.sum(w)-1})
-        bounds=[(0,1),(0,1)]
-        res = minimize(objective, [0.5,0.5], bounds=bounds, constraints=cons)
-        self.optimal_weights = res.x
+        # 最大夏普比率的权重有公式: w 和 协方差的逆 × 均值 成正比, 不用随机抽10000个收益再用minimize去找.
+        # 两个均值都大于0时权重都在0到1之间; 有负的就把它设成0, 只买另一个
+        w = np.clip(np.linalg.solve(cov, mu), 0, None)
+        self.optimal_weights = w / w.sum() if w.sum() > 0 else np.array([1.0, 0.0])
 
         # 计算组合收益和风险
-        port_return = np.mean(self.optimal_weights[0]*bond_returns + self.optimal_weights[1]*option_returns)*252*100
-        port_risk = np.std(self.optimal_weights[0]*bond_returns + self.optimal_weights[1]*option_returns)*np.sqrt(252)*100
+        port_return = self.optimal_weights @ mu * 252 * 100
+        port_risk = np.sqrt(self.optimal_weights @ cov @ self.optimal_weights) * np.sqrt(252) * 100
         print(f"最优组合: 债卷{self.optimal_weights[0]:.2f}, 期权: {self.optimal_weights[1]:.2f}")
         print(f"组合年化收益{port_return:.2f}%, 年化风险{port_risk:.2f}%")
         return True
@@ -233,7 +258,7 @@ if __name__ == "__main__":
     将债券和期权组合构建为一个量化投资组合。
     使用 QuantLib 进行债券定价和期权希腊值计算。
     分析债券收益率、期权隐含波动率。
-    通过蒙特卡洛模拟和 scipy.optimize 计算最优组合权重。
+    用最大夏普比率的公式计算最优组合权重。
     输出组合年化收益、年化风险、夏普比率。
 
 2. 核心模块
@@ -254,5 +279,5 @@ if __name__ == "__main__":
         计算 Delta、Gamma、Vega、Theta，帮助理解期权风险敏感度。
     
     组合优化 (optimize_portfolio)
-        利用蒙特卡洛模拟债券和期权日收益。
+        根据债券和期权日收益的均值和波动率, 直接算出最大夏普比率的权重。
 '''
\ No newline at end of file
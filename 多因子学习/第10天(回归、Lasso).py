@@ -6,7 +6,12 @@
 练习：用简单回归模型做因子权重拟合
 '''
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+from scipy.linalg import cho_factor, cho_solve
+from sklearn.base import clone
 from sklearn.linear_model import Ridge, Lasso, LinearRegression
 from sklearn.preprocessing import StandardScaler
 import matplotlib.pyplot as plt
@@ -40,34 +45,100 @@ weights_list = []      # 用于存储每个月各模型因子权重
 
 # ================== 2. 按月份滚动回归计算因子权重 ==================
 months = sorted(df['Month'].unique())
-for month in months:
-    # 训练数据为当月及以前所有数据
-    train_data = df[df['Month'] <= month].dropna(subset=factor_cols + [target])
-    if ROLLING_WINDOW is not None:
-        train_data = train_data.tail(ROLLING_WINDOW)    # 可选：仅取最近 N 条数据
-    if train_data.empty:
+
+# 有效数据按月份排好 (同一个月里保持原来的顺序), 当月及以前的训练数据就是前 month_end 行
+valid = df.dropna(subset=factor_cols + [target]).sort_values('Month', kind='stable')
+X_all = valid[factor_cols].to_numpy(dtype=np.float64)
+y_all = valid[target].to_numpy(dtype=np.float64)
+month_end = valid.groupby('Month').size().reindex(months, fill_value=0).cumsum().to_numpy()
+
+# 每个月只把新增的数据加到累加和里 (X^T X, X^T y 等), 标准化用的均值、标准差和
+# 线性回归/岭回归要解的方程都从累加和算出来, 不用每个月重新扫描全部历史数据
+n_factors = len(factor_cols)
+
+
+def fit_with_sklearn(model, start, end, mean, std):
+    # 在线程里拟合一个月: sklearn 的坐标下降在C代码里运行时会释放GIL, 几个月可以同时算
+    # 每个月用模型的副本, 线程之间不共用同一个模型对象; 模型报错时返回 None
+    try:
+        return clone(model).fit((X_all[start:end] - mean) / std, y_all[start:end]).coef_
+    except:
+        return None
+
+
+def save_coefs(month_weights, name, coefs):
+    # 将每个因子的系数保存到字典; 如果模型报错，则对应因子权重设为 None
+    if coefs is None:
+        month_weights.update({f"{name}_{f}": None for f in factor_cols})
+    else:
+        month_weights.update({f"{name}_{f}": coef for f, coef in zip(factor_cols, coefs)})
+
+
+executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+sklearn_jobs = []   # (当月权重字典, 模型名, future), 全部月份提交完再统一取结果
+sum_x = np.zeros(n_factors)
+sum_y = 0.0
+sum_xx = np.zeros((n_factors, n_factors))
+sum_xy = np.zeros(n_factors)
+prev_end = 0
+for month, end in zip(months, month_end):
+    new_x = X_all[prev_end:end]
+    new_y = y_all[prev_end:end]
+    sum_x += new_x.sum(axis=0)
+    sum_y += new_y.sum()
+    sum_xx += new_x.T @ new_x
+    sum_xy += new_x.T @ new_y
+    prev_end = end
+
+    # 训练数据为当月及以前所有数据; 可选：仅取最近 N 条数据
+    start = 0 if ROLLING_WINDOW is None else max(end - ROLLING_WINDOW, 0)
+    if end == start:
         continue    # 如果没有数据就跳过
 
-    x_train = train_data[factor_cols].values
-    y_train = train_data[target].values
+    x_train = X_all[start:end]
+    y_train = y_all[start:end]
+    if ROLLING_WINDOW is None:
+        n, sx, sy, sxx, sxy = end, sum_x, sum_y, sum_xx, sum_xy
+    else:
+        n, sx, sy, sxx, sxy = len(x_train), x_train.sum(axis=0), y_train.sum(), x_train.T @ x_train, x_train.T @ y_train
+
+    # 标准化特征，保证每个因子同等量纲 (和StandardScaler一样用总体标准差, 标准差为0的因子不缩放)
+    mean = sx / n
+    std = np.sqrt(np.maximum(np.diag(sxx) / n - mean ** 2, 0))
+    std[std == 0] = 1.0
 
-    scaler = StandardScaler()       # 标准化特征，保证每个因子同等量纲
-    x_train_scaled = scaler.fit_transform(x_train)
+    # 标准化(并减去均值)以后的 X^T X 和 X^T y, 模型带截距, 所以都要先去均值
+    gram = (sxx - n * np.outer(mean, mean)) / np.outer(std, std)
+    rhs = (sxy - mean * sy) / std
 
     # 用字典存储当月各模型因子权重
     month_weights = {'Month': str(month)}
     for name, model in models.items():
+        if name not in ('Linear', 'Ridge'):
+            # Lasso 没有公式解, 还是用sklearn拟合; 放到线程池里, 和后面月份的计算同时进行
+            sklearn_jobs.append((month_weights, name, executor.submit(fit_with_sklearn, model, start, end, mean, std)))
+            continue
         try:
-            model.fit(x_train_scaled, y_train)  # 拟合模型
-            # 将每个因子的系数保存到字典
-            month_weights.update({f"{name}_{f}": coef for f, coef in zip(factor_cols, model.coef_)})
+            if name == 'Linear':
+                coefs = np.linalg.lstsq(gram, rhs, rcond=None)[0]                   # 正规方程 X^T X b = X^T y
+            else:
+                coefs = cho_solve(cho_factor(gram + model.alpha * np.eye(n_factors)), rhs)    # (X^T X + alpha*I) b = X^T y
         except:
-            # 如果模型报错，则对应因子权重设为 None
-            month_weights.update({f"{name}_{f}": None for f in factor_cols})
+            coefs = None
+        save_coefs(month_weights, name, coefs)
     weights_list.append(month_weights)
 
+# 等所有月份的sklearn拟合完成, 按提交顺序把系数填回各月的字典
+for month_weights, name, future in sklearn_jobs:
+    save_coefs(month_weights, name, future.result())
+executor.shutdown()
+
 weights_df = pd.DataFrame(weights_list)  # 最终存储每月各模型因子权重
 
+# Ridge 权重先转成矩阵 (一行一个月), 打分时按月份直接取行, 不用每个月在 weights_df 里比较一遍月份字符串
+ridge_mat = weights_df[[f'Ridge_{f}' for f in factor_cols]].to_numpy(dtype=np.float64)
+month_to_idx = {m: i for i, m in enumerate(weights_df['Month'])}
+
 # ================== 3. 计算每只股票每日因子得分 ==================
 scores_list = []
 for month in months:
@@ -76,10 +147,9 @@ for month in months:
         continue
 
     # 使用 Ridge 回归权重计算当月因子得分
-    ridge_weights = weights_df.loc[weights_df['Month']==str(month), [f'Ridge_{f}' for f in factor_cols]]
-    if ridge_weights.empty:
+    if str(month) not in month_to_idx:
         continue
-    ridge_weights = ridge_weights.iloc[0].values
+    ridge_weights = ridge_mat[month_to_idx[str(month)]]
 
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(month_data[factor_cols].values)
@@ -89,7 +159,11 @@ for month in months:
 
     # 选出前20%股票
     top_n = int(len(month_data) * 0.2) if len(month_data) > 5 else len(month_data)
-    top_stocks = month_data.nlargest(top_n, 'FactorScore')
+    # argpartition 先在线性时间里找出得分最高的 top_n 个, 只对这 top_n 个排序, 不用把整个月的数据全排一遍
+    scores = month_data['FactorScore'].to_numpy()
+    idx = np.argpartition(-scores, top_n - 1)[:top_n]
+    idx = idx[np.argsort(-scores[idx], kind='stable')]
+    top_stocks = month_data.iloc[idx]
 
     # 保存结果
     scores_list.append(top_stocks[['Date', 'Month', 'company', 'FactorScore']])